@@ -10,11 +10,42 @@
 """
 
 import os
+import asyncio
+import importlib
+from collections import deque
+from itertools import islice
+from functools import lru_cache
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional, Union
-from dataclasses import dataclass, field
-from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union, get_origin
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timedelta, timezone
 import json
+import logging
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    
+    def _json_dumps_pretty(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps_pretty(obj: Any) -> bytes:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from cachetools import LRUCache
+except ImportError:
+    LRUCache = None
+
+
+_log = logging.getLogger(__name__)
 
 
 # ============= 抽象接口定义 =============
@@ -27,9 +58,21 @@ class MemoryStorage(ABC):
         """保存消息到存储"""
         pass
     
+    async def save_messages(self, user_id: str, session_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """按顺序批量保存同一会话的多条消息（role/content/metadata）
+        
+        默认逐条调用 save_message，存储实现可覆盖为一次写入。
+        """
+        for message in messages:
+            await self.save_message(user_id, session_id, message["role"], message["content"], message.get("metadata"))
+        return True
+    
     @abstractmethod
     async def get_history(self, user_id: str, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
-        """获取历史记录"""
+        """获取历史记录
+        
+        每条记录的 timestamp 为datetime：带时区的时间，或不带时区的本地时间。
+        """
         pass
     
     @abstractmethod
@@ -71,6 +114,28 @@ class LogStorage(ABC):
         """获取日志记录"""
         pass
     
+    def is_enabled(self, kind: str) -> bool:
+        """是否记录指定类型（request/response/error）的日志
+        
+        调用方应先检查此方法，未启用时可跳过日志数据的构建。
+        """
+        return True
+    
+    @property
+    def requests_enabled(self) -> bool:
+        """是否记录请求日志"""
+        return self.is_enabled("request")
+    
+    @property
+    def responses_enabled(self) -> bool:
+        """是否记录响应日志"""
+        return self.is_enabled("response")
+    
+    @property
+    def errors_enabled(self) -> bool:
+        """是否记录错误日志"""
+        return self.is_enabled("error")
+    
     @abstractmethod
     async def initialize(self) -> bool:
         """初始化日志存储"""
@@ -84,7 +149,7 @@ class LogStorage(ABC):
 
 # ============= 配置数据类 =============
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class APIConfig:
     """API配置"""
     api_key: str = None
@@ -94,19 +159,26 @@ class APIConfig:
     retry_delay: float = 1.0
 
 
-@dataclass
+# 默认可用模型（所有ModelConfig实例共享）
+_AVAILABLE_MODELS = ("qwen-plus", "qwen-max", "qwen-vl-plus", "qwen-vl-max")
+
+
+@dataclass(slots=True, frozen=True)
 class ModelConfig:
     """模型配置"""
     default_model: str = "qwen-plus"
     default_temperature: float = 0.7
     default_max_tokens: int = 2000
     default_system_message: str = None
-    available_models: List[str] = field(default_factory=lambda: [
-        "qwen-plus", "qwen-max", "qwen-vl-plus", "qwen-vl-max"
-    ])
+    available_models: Tuple[str, ...] = _AVAILABLE_MODELS
+    
+    def __post_init__(self):
+        # 从字典/文件加载时可能传入列表，统一为元组以保持不可变
+        if not isinstance(self.available_models, tuple):
+            object.__setattr__(self, 'available_models', tuple(self.available_models))
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MemoryConfig:
     """记忆配置"""
     enabled: bool = True
@@ -128,7 +200,7 @@ class MemoryConfig:
     custom_storage: MemoryStorage = None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class LogConfig:
     """日志配置"""
     enabled: bool = True
@@ -149,7 +221,11 @@ class LogConfig:
     custom_storage: LogStorage = None
 
 
-@dataclass
+# to_dict 不导出的字段：敏感信息及自定义存储实例
+_TO_DICT_EXCLUDED = frozenset({'redis_password', 'custom_storage'})
+
+
+@dataclass(slots=True, frozen=True)
 class QianwenConfig:
     """千问工具类主配置"""
     api: APIConfig = field(default_factory=APIConfig)
@@ -159,159 +235,289 @@ class QianwenConfig:
     
     @classmethod
     def from_env(cls) -> 'QianwenConfig':
-        """从环境变量创建配置"""
-        config = cls()
-        
-        # API配置
-        config.api.api_key = os.getenv('QIANWEN_API_KEY') or os.getenv('DASHSCOPE_API_KEY')
-        config.api.base_url = os.getenv('QIANWEN_BASE_URL', config.api.base_url)
-        config.api.timeout = int(os.getenv('QIANWEN_TIMEOUT', config.api.timeout))
-        
-        # 模型配置
-        config.model.default_model = os.getenv('QIANWEN_DEFAULT_MODEL', config.model.default_model)
-        config.model.default_temperature = float(os.getenv('QIANWEN_DEFAULT_TEMPERATURE', config.model.default_temperature))
-        config.model.default_max_tokens = int(os.getenv('QIANWEN_DEFAULT_MAX_TOKENS', config.model.default_max_tokens))
-        config.model.default_system_message = os.getenv('QIANWEN_DEFAULT_SYSTEM_MESSAGE')
-        
-        # 记忆配置
-        config.memory.enabled = os.getenv('QIANWEN_MEMORY_ENABLED', 'true').lower() == 'true'
-        config.memory.storage_type = os.getenv('QIANWEN_MEMORY_STORAGE', config.memory.storage_type)
-        config.memory.mongo_uri = os.getenv('MONGO_URI', config.memory.mongo_uri)
-        config.memory.mongo_database = os.getenv('MONGO_DATABASE', config.memory.mongo_database)
-        config.memory.max_history_length = int(os.getenv('QIANWEN_MAX_HISTORY', config.memory.max_history_length))
-        
-        # 日志配置
-        config.log.enabled = os.getenv('QIANWEN_LOG_ENABLED', 'true').lower() == 'true'
-        config.log.storage_type = os.getenv('QIANWEN_LOG_STORAGE', config.log.storage_type)
-        config.log.log_level = os.getenv('QIANWEN_LOG_LEVEL', config.log.log_level)
-        config.log.mongo_uri = os.getenv('LOG_MONGO_URI', config.log.mongo_uri)
-        config.log.mongo_database = os.getenv('LOG_MONGO_DATABASE', config.log.mongo_database)
-        
-        return config
+        """从环境变量创建配置
+
+        相同的环境变量取值会复用缓存的（不可变）配置实例。
+        """
+        return _build_from_env(tuple(map(os.environ.get, _ENV_KEYS)))
     
     @classmethod
     def from_dict(cls, config_dict: Dict[str, Any]) -> 'QianwenConfig':
-        """从字典创建配置"""
-        config = cls()
-        
-        if 'api' in config_dict:
-            api_config = config_dict['api']
-            config.api = APIConfig(**api_config)
-        
-        if 'model' in config_dict:
-            model_config = config_dict['model']
-            config.model = ModelConfig(**model_config)
-        
-        if 'memory' in config_dict:
-            memory_config = config_dict['memory']
-            config.memory = MemoryConfig(**memory_config)
-        
-        if 'log' in config_dict:
-            log_config = config_dict['log']
-            config.log = LogConfig(**log_config)
-        
-        return config
+        """从字典创建配置（未知字段会抛出TypeError）"""
+        return _config_from_dict(config_dict)
     
     @classmethod
     def from_file(cls, config_file: str) -> 'QianwenConfig':
         """从配置文件创建配置"""
-        with open(config_file, 'r', encoding='utf-8') as f:
-            if config_file.endswith('.json'):
-                config_dict = json.load(f)
+        if not config_file.endswith('.json'):
+            # 支持其他格式，如YAML
+            raise ValueError(f"不支持的配置文件格式: {config_file}")
+        
+        with open(config_file, 'rb') as f:
+            if ijson is not None and os.fstat(f.fileno()).st_size > _STREAM_PARSE_THRESHOLD:
+                # 大文件流式解析，只构建 api/model/memory/log 四个配置段
+                config_dict = _load_config_sections(f)
             else:
-                # 支持其他格式，如YAML
-                raise ValueError(f"不支持的配置文件格式: {config_file}")
+                config_dict = _json_loads(f.read())
         
         return cls.from_dict(config_dict)
     
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典"""
-        return {
-            'api': {
-                'api_key': self.api.api_key,
-                'base_url': self.api.base_url,
-                'timeout': self.api.timeout,
-                'max_retries': self.api.max_retries,
-                'retry_delay': self.api.retry_delay
-            },
-            'model': {
-                'default_model': self.model.default_model,
-                'default_temperature': self.model.default_temperature,
-                'default_max_tokens': self.model.default_max_tokens,
-                'default_system_message': self.model.default_system_message,
-                'available_models': self.model.available_models
-            },
-            'memory': {
-                'enabled': self.memory.enabled,
-                'storage_type': self.memory.storage_type,
-                'max_history_length': self.memory.max_history_length,
-                'ttl_hours': self.memory.ttl_hours,
-                'mongo_uri': self.memory.mongo_uri,
-                'mongo_database': self.memory.mongo_database,
-                'mongo_collection': self.memory.mongo_collection,
-                'redis_host': self.memory.redis_host,
-                'redis_port': self.memory.redis_port,
-                'redis_db': self.memory.redis_db,
-                'file_storage_path': self.memory.file_storage_path
-            },
-            'log': {
-                'enabled': self.log.enabled,
-                'storage_type': self.log.storage_type,
-                'log_level': self.log.log_level,
-                'log_requests': self.log.log_requests,
-                'log_responses': self.log.log_responses,
-                'log_errors': self.log.log_errors,
-                'mongo_uri': self.log.mongo_uri,
-                'mongo_database': self.log.mongo_database,
-                'mongo_collection': self.log.mongo_collection,
-                'file_storage_path': self.log.file_storage_path,
-                'file_rotation': self.log.file_rotation,
-                'max_file_size': self.log.max_file_size
-            }
-        }
+        """转换为字典（每次调用返回新的字典，调用方可以随意修改）"""
+        return _config_to_dict(self)
     
     def save_to_file(self, config_file: str) -> None:
         """保存配置到文件"""
-        config_dict = self.to_dict()
+        if not config_file.endswith('.json'):
+            raise ValueError(f"不支持的配置文件格式: {config_file}")
         
-        with open(config_file, 'w', encoding='utf-8') as f:
-            if config_file.endswith('.json'):
-                json.dump(config_dict, f, indent=2, ensure_ascii=False)
-            else:
-                raise ValueError(f"不支持的配置文件格式: {config_file}")
+        with open(config_file, 'wb') as f:
+            f.write(_json_dumps_pretty(self.to_dict()))
+
+
+# 超过该大小（字节）的配置文件在安装了ijson时使用流式解析
+_STREAM_PARSE_THRESHOLD = 1 << 20
+
+# 配置文件中会被读取的顶层配置段
+_CONFIG_SECTIONS = frozenset({'api', 'model', 'memory', 'log'})
+
+
+def _load_config_sections(f) -> Dict[str, Any]:
+    """使用ijson流式解析配置文件，仅为已知配置段构建对象，其余键直接跳过"""
+    builders: Dict[str, Any] = {}
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if not prefix:
+            continue
+        section = prefix.partition('.')[0]
+        if section in _CONFIG_SECTIONS:
+            builder = builders.get(section)
+            if builder is None:
+                builder = builders[section] = ijson.ObjectBuilder()
+            builder.event(event, value)
+    return {section: builder.value for section, builder in builders.items()}
+
+def _compile_to_dict(config_cls: type) -> Callable[[Any], Dict[str, Any]]:
+    """根据配置类的字段生成专用的序列化函数（字段访问直接展开，无需运行时反射）
+    
+    每次调用都构建新的嵌套字典，元组字段转换为新的列表，结果不与配置或其他调用方共享。
+    """
+    def value_expr(section: str, f) -> str:
+        expr = f"{section}.{f.name}"
+        if get_origin(f.type) is tuple:
+            return f"(list({expr}) if {expr} is not None else None)"
+        return expr
+    
+    lines = ["def to_dict(config):"]
+    body = []
+    for section_field in fields(config_cls):
+        if not section_field.init:
+            continue
+        name = section_field.name
+        lines.append(f"    {name} = config.{name}")
+        items = ", ".join(
+            f"{f.name!r}: {value_expr(name, f)}"
+            for f in fields(section_field.type) if f.name not in _TO_DICT_EXCLUDED
+        )
+        body.append(f"        {name!r}: {{{items}}},")
+    lines.append("    return {")
+    lines.extend(body)
+    lines.append("    }")
+    
+    namespace: Dict[str, Any] = {}
+    exec("\n".join(lines), namespace)
+    return namespace["to_dict"]
+
+
+def _compile_from_dict(config_cls: type) -> Callable[[Dict[str, Any]], Any]:
+    """根据配置类的字段生成专用的构建函数（各配置段按顺序直接构造，无需运行时反射）"""
+    namespace: Dict[str, Any] = {"config_cls": config_cls}
+    lines = ["def from_dict(config_dict):", "    sections = {}"]
+    for section_field in fields(config_cls):
+        if not section_field.init:
+            continue
+        name = section_field.name
+        section_cls = section_field.type.__name__
+        namespace[section_cls] = section_field.type
+        lines.append(f"    section = config_dict.get({name!r})")
+        lines.append("    if section is not None:")
+        lines.append(f"        sections[{name!r}] = {section_cls}(**section)")
+    lines.append("    return config_cls(**sections)")
+    
+    exec("\n".join(lines), namespace)
+    return namespace["from_dict"]
+
+
+_config_to_dict = _compile_to_dict(QianwenConfig)
+_config_from_dict = _compile_from_dict(QianwenConfig)
+
+
+# ============= 环境变量配置 =============
+
+# 环境变量类型转换
+_COERCE = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": lambda value: value.lower() == 'true',
+}
+
+# from_env 读取的环境变量：(变量名, 配置段, 属性名, 类型)
+# 按顺序应用，后出现的同名属性覆盖前者（QIANWEN_API_KEY 优先于 DASHSCOPE_API_KEY）
+_ENV_SPEC = (
+    # API配置
+    ('DASHSCOPE_API_KEY', 'api', 'api_key', 'str'),
+    ('QIANWEN_API_KEY', 'api', 'api_key', 'str'),
+    ('QIANWEN_BASE_URL', 'api', 'base_url', 'str'),
+    ('QIANWEN_TIMEOUT', 'api', 'timeout', 'int'),
+    # 模型配置
+    ('QIANWEN_DEFAULT_MODEL', 'model', 'default_model', 'str'),
+    ('QIANWEN_DEFAULT_TEMPERATURE', 'model', 'default_temperature', 'float'),
+    ('QIANWEN_DEFAULT_MAX_TOKENS', 'model', 'default_max_tokens', 'int'),
+    ('QIANWEN_DEFAULT_SYSTEM_MESSAGE', 'model', 'default_system_message', 'str'),
+    # 记忆配置
+    ('QIANWEN_MEMORY_ENABLED', 'memory', 'enabled', 'bool'),
+    ('QIANWEN_MEMORY_STORAGE', 'memory', 'storage_type', 'str'),
+    ('MONGO_URI', 'memory', 'mongo_uri', 'str'),
+    ('MONGO_DATABASE', 'memory', 'mongo_database', 'str'),
+    ('QIANWEN_MAX_HISTORY', 'memory', 'max_history_length', 'int'),
+    # 日志配置
+    ('QIANWEN_LOG_ENABLED', 'log', 'enabled', 'bool'),
+    ('QIANWEN_LOG_STORAGE', 'log', 'storage_type', 'str'),
+    ('QIANWEN_LOG_LEVEL', 'log', 'log_level', 'str'),
+    ('LOG_MONGO_URI', 'log', 'mongo_uri', 'str'),
+    ('LOG_MONGO_DATABASE', 'log', 'mongo_database', 'str'),
+)
+
+# from_env 的缓存键由这些变量的取值按顺序组成
+_ENV_KEYS = tuple(name for name, _, _, _ in _ENV_SPEC)
+
+
+@lru_cache(maxsize=8)
+def _build_from_env(env_values: Tuple[Optional[str], ...]) -> QianwenConfig:
+    """根据环境变量快照（与 _ENV_KEYS 顺序一致的取值）构建配置，未设置或为空的变量保留默认值"""
+    overrides: Dict[str, Dict[str, Any]] = {'api': {}, 'model': {}, 'memory': {}, 'log': {}}
+    for (_, section, attr, coerce), raw in zip(_ENV_SPEC, env_values):
+        if raw:
+            overrides[section][attr] = _COERCE[coerce](raw)
+    return QianwenConfig(
+        api=APIConfig(**overrides['api']),
+        model=ModelConfig(**overrides['model']),
+        memory=MemoryConfig(**overrides['memory']),
+        log=LogConfig(**overrides['log'])
+    )
+
+
+# 测试或运行时修改环境变量后可调用 QianwenConfig.from_env.cache_clear() 强制重新读取
+QianwenConfig.from_env.__func__.cache_clear = _build_from_env.cache_clear
 
 
 # ============= 默认实现 =============
 
+def _public_message(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """复制缓存中的消息返回给调用方，元数据为新的普通字典（缓存中无元数据时为None）"""
+    metadata = entry["metadata"]
+    return {**entry, "metadata": dict(metadata) if metadata else {}}
+
+# get_history / get_logs 查询只取需要的字段
+_HISTORY_PROJECTION = {"_id": 0, "role": 1, "content": 1, "metadata": 1, "timestamp": 1}
+_LOG_FIELDS = ("user_id", "session_id", "log_type", "data", "timestamp", "request_id")
+
+# 日志类型 -> LogConfig 中对应的开关
+_LOG_KIND_FLAGS = {"request": "log_requests", "response": "log_responses", "error": "log_errors"}
+
+
+# Motor客户端连接池参数
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 32,
+    "minPoolSize": 4,
+    "serverSelectionTimeoutMS": 3000,
+}
+
+# 按URI共享的Motor客户端及引用计数，记忆存储与日志存储使用同一集群时共用连接池
+_MONGO_CLIENTS: Dict[str, Any] = {}
+_MONGO_CLIENT_REFS: Dict[str, int] = {}
+
+
+def _acquire_mongo_client(uri: str):
+    """获取（必要时创建）指定URI的共享Motor客户端"""
+    client = _MONGO_CLIENTS.get(uri)
+    if client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = _MONGO_CLIENTS[uri] = AsyncIOMotorClient(uri, **MONGO_CLIENT_OPTIONS)
+    _MONGO_CLIENT_REFS[uri] = _MONGO_CLIENT_REFS.get(uri, 0) + 1
+    return client
+
+
+def _release_mongo_client(uri: str) -> None:
+    """释放共享客户端，最后一个使用者释放时关闭连接"""
+    refs = _MONGO_CLIENT_REFS.get(uri, 0) - 1
+    if refs > 0:
+        _MONGO_CLIENT_REFS[uri] = refs
+        return
+    _MONGO_CLIENT_REFS.pop(uri, None)
+    client = _MONGO_CLIENTS.pop(uri, None)
+    if client is not None:
+        client.close()
+
+
+class _CoarseUtcClock:
+    """粗粒度UTC时钟：同一毫秒内复用同一个datetime对象，减少突发写入时的时间对象构造"""
+    
+    RESOLUTION = 0.001  # 秒
+    
+    def __init__(self):
+        self._base: Optional[datetime] = None
+        self._base_mono = 0.0
+    
+    def now(self) -> datetime:
+        """返回当前UTC时间（精度为 RESOLUTION）"""
+        mono = asyncio.get_running_loop().time()
+        if self._base is None or mono - self._base_mono > self.RESOLUTION:
+            self._base = datetime.utcnow()
+            self._base_mono = mono
+        return self._base
+
+
 class MongoMemoryStorage(MemoryStorage):
-    """MongoDB记忆存储实现"""
+    """MongoDB记忆存储实现
+    
+    每个会话最近 max_history_length 条消息缓存在进程内（LRU，最多 HISTORY_CACHE_SIZE 个会话），
+    命中时 get_history 不再访问MongoDB。
+    """
+    
+    HISTORY_CACHE_SIZE = 1024
     
     def __init__(self, config: MemoryConfig):
         self.config = config
         self._client = None
         self._collection = None
+        self._history_cache = LRUCache(maxsize=self.HISTORY_CACHE_SIZE) if LRUCache else None
     
     async def initialize(self) -> bool:
         """初始化MongoDB连接"""
         try:
-            from motor.motor_asyncio import AsyncIOMotorClient
-            self._client = AsyncIOMotorClient(self.config.mongo_uri)
+            from pymongo import IndexModel
+            self._client = _acquire_mongo_client(self.config.mongo_uri)
             db = self._client[self.config.mongo_database]
             self._collection = db[self.config.mongo_collection]
             
-            # 创建索引
-            await self._collection.create_index([("user_id", 1), ("session_id", 1), ("timestamp", -1)])
+            # 创建索引：等值条件 + 时间排序可直接沿索引扫描（复合索引可双向遍历），无需内存排序
+            # 保持原有的键顺序，已有部署不会多出一个等价索引
+            indexes = [IndexModel([("user_id", 1), ("session_id", 1), ("timestamp", -1)])]
             
-            # 设置TTL索引
+            # 设置TTL索引（独立的单字段索引，与上面的复合索引互不影响）
             if self.config.ttl_hours > 0:
-                await self._collection.create_index(
+                indexes.append(IndexModel(
                     "timestamp", 
                     expireAfterSeconds=self.config.ttl_hours * 3600
-                )
+                ))
+            
+            # 一次命令提交全部索引
+            await self._collection.create_indexes(indexes)
             
             return True
-        except Exception as e:
-            print(f"MongoDB记忆存储初始化失败: {e}")
+        except Exception:
+            _log.warning("MongoDB记忆存储初始化失败", exc_info=True)
             return False
     
     async def save_message(self, user_id: str, session_id: str, role: str, content: str, metadata: Dict[str, Any] = None) -> bool:
@@ -325,42 +531,101 @@ class MongoMemoryStorage(MemoryStorage):
                 "session_id": session_id,
                 "role": role,
                 "content": content,
-                "metadata": metadata or {},
                 "timestamp": datetime.utcnow()
             }
+            # 无元数据时不写入该字段，读取时缺失等同于空元数据
+            if metadata:
+                document["metadata"] = metadata
             
             await self._collection.insert_one(document)
+            
+            self._append_cached(user_id, session_id, [document])
             return True
-        except Exception as e:
-            print(f"保存消息失败: {e}")
+        except Exception:
+            _log.warning("保存消息失败", exc_info=True)
             return False
     
+    async def save_messages(self, user_id: str, session_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """批量保存消息（一次 insert_many）"""
+        if self._collection is None:
+            return False
+        if not messages:
+            return True
+        
+        try:
+            # BSON时间精度为毫秒，同一批消息依次递增1毫秒，保证按时间排序时顺序不变
+            now = datetime.utcnow()
+            documents = []
+            for offset, message in enumerate(messages):
+                document = {
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "role": message["role"],
+                    "content": message["content"],
+                    "timestamp": now + timedelta(milliseconds=offset)
+                }
+                if message.get("metadata"):
+                    document["metadata"] = message["metadata"]
+                documents.append(document)
+            
+            await self._collection.insert_many(documents)
+            
+            self._append_cached(user_id, session_id, documents)
+            return True
+        except Exception:
+            _log.warning("批量保存消息失败", exc_info=True)
+            return False
+    
+    def _append_cached(self, user_id: str, session_id: str, documents: List[Dict[str, Any]]) -> None:
+        """只追加到已缓存的会话，未缓存的会话在下次读取时从MongoDB加载"""
+        cached = self._history_cache.get((user_id, session_id)) if self._history_cache is not None else None
+        if cached is not None:
+            cached.extend({
+                "role": document["role"],
+                "content": document["content"],
+                "metadata": document.get("metadata"),
+                "timestamp": document["timestamp"].replace(tzinfo=timezone.utc)
+            } for document in documents)
+    
     async def get_history(self, user_id: str, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """获取历史记录"""
         if self._collection is None:
             return []
         
         try:
-            query = {"user_id": user_id, "session_id": session_id}
-            cursor = self._collection.find(query).sort("timestamp", 1)
-            
-            if limit:
-                cursor = cursor.limit(limit)
-            elif self.config.max_history_length > 0:
-                cursor = cursor.limit(self.config.max_history_length)
+            window = self.config.max_history_length if self.config.max_history_length > 0 else None
+            use_cache = self._history_cache is not None and not (limit and window and limit > window)
+            key = (user_id, session_id)
             
-            messages = []
-            async for doc in cursor:
-                messages.append({
-                    "role": doc["role"],
-                    "content": doc["content"],
-                    "metadata": doc.get("metadata", {}),
-                    "timestamp": doc["timestamp"]
-                })
+            cached = self._history_cache.get(key) if use_cache else None
+            if cached is None:
+                # 取最近的消息：按时间倒序查询后再反转为正序
+                query = {"user_id": user_id, "session_id": session_id}
+                cursor = self._collection.find(query, _HISTORY_PROJECTION).sort("timestamp", -1)
+                
+                fetch_limit = window if use_cache else (limit or window)
+                if fetch_limit:
+                    cursor = cursor.limit(fetch_limit)
+                
+                messages = []
+                async for doc in cursor:
+                    messages.append({
+                        "role": doc["role"],
+                        "content": doc["content"],
+                        "metadata": doc.get("metadata"),
+                        # MongoDB中保存的是UTC时间，读出时不带时区，这里标记为UTC
+                        "timestamp": doc["timestamp"].replace(tzinfo=timezone.utc)
+                    })
+                messages.reverse()
+                
+                if not use_cache:
+                    return [_public_message(message) for message in messages]
+                cached = self._history_cache[key] = deque(messages, maxlen=window)
             
-            return messages
-        except Exception as e:
-            print(f"获取历史记录失败: {e}")
+            start = len(cached) - limit if limit and limit < len(cached) else 0
+            return [_public_message(message) for message in islice(cached, start, None)]
+        except Exception:
+            _log.warning("获取历史记录失败", exc_info=True)
             return []
     
     async def clear_history(self, user_id: str, session_id: str) -> bool:
@@ -371,106 +636,141 @@ class MongoMemoryStorage(MemoryStorage):
         try:
             query = {"user_id": user_id, "session_id": session_id}
             await self._collection.delete_many(query)
+            if self._history_cache is not None:
+                self._history_cache.pop((user_id, session_id), None)
             return True
-        except Exception as e:
-            print(f"清除历史记录失败: {e}")
+        except Exception:
+            _log.warning("清除历史记录失败", exc_info=True)
             return False
     
     async def close(self) -> None:
-        """关闭连接"""
+        """释放连接"""
         if self._client:
-            self._client.close()
+            _release_mongo_client(self.config.mongo_uri)
+            self._client = None
 
 
 class MongoLogStorage(LogStorage):
-    """MongoDB日志存储实现"""
+    """MongoDB日志存储实现
+    
+    日志文档先进入内存队列，由后台任务批量写入（insert_many），
+    每批最多 BATCH_SIZE 条或等待 FLUSH_INTERVAL 秒。
+    """
+    
+    BATCH_SIZE = 256
+    FLUSH_INTERVAL = 0.05  # 秒
+    POOL_SIZE = 1024
     
     def __init__(self, config: LogConfig):
         self.config = config
         self._client = None
         self._collection = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._clock = _CoarseUtcClock()
+        # 已写入文档的复用池，避免每条日志分配新字典
+        self._pool: deque = deque(maxlen=self.POOL_SIZE)
     
     async def initialize(self) -> bool:
         """初始化MongoDB连接"""
         try:
-            from motor.motor_asyncio import AsyncIOMotorClient
-            self._client = AsyncIOMotorClient(self.config.mongo_uri)
+            from pymongo import IndexModel, WriteConcern
+            self._client = _acquire_mongo_client(self.config.mongo_uri)
             db = self._client[self.config.mongo_database]
-            self._collection = db[self.config.mongo_collection]
+            collection = db[self.config.mongo_collection]
             
-            # 创建索引
-            await self._collection.create_index([("user_id", 1), ("timestamp", -1)])
-            await self._collection.create_index([("session_id", 1), ("timestamp", -1)])
-            await self._collection.create_index("log_type")
+            # 创建索引（使用默认写关注，确保索引创建结果可知）
+            await collection.create_indexes([
+                IndexModel([("user_id", 1), ("timestamp", -1)]),
+                IndexModel([("session_id", 1), ("timestamp", -1)]),
+                IndexModel("log_type")
+            ])
+            
+            # 日志写入不等待服务端确认（w=0），记忆存储仍保持默认确认
+            self._collection = collection.with_options(write_concern=WriteConcern(w=0))
+            
+            # 启动后台批量写入任务
+            self._queue = asyncio.Queue()
+            self._flusher_task = asyncio.create_task(self._flusher())
             
             return True
-        except Exception as e:
-            print(f"MongoDB日志存储初始化失败: {e}")
+        except Exception:
+            _log.warning("MongoDB日志存储初始化失败", exc_info=True)
             return False
     
+    def is_enabled(self, kind: str) -> bool:
+        """是否记录指定类型的日志（需已初始化且对应开关开启）"""
+        return self._queue is not None and getattr(self.config, _LOG_KIND_FLAGS[kind])
+    
     async def log_request(self, user_id: str, session_id: str, request_data: Dict[str, Any]) -> bool:
         """记录请求日志"""
-        if not self.config.log_requests or self._collection is None:
+        if not self.is_enabled("request"):
             return False
         
         try:
-            document = {
-                "user_id": user_id,
-                "session_id": session_id,
-                "log_type": "request",
-                "data": request_data,
-                "timestamp": datetime.utcnow()
-            }
+            document = self._pool.pop() if self._pool else {}
+            document.update(
+                user_id=user_id,
+                session_id=session_id,
+                log_type="request",
+                data=request_data,
+                timestamp=self._clock.now()
+            )
             
-            await self._collection.insert_one(document)
+            self._queue.put_nowait(document)
             return True
-        except Exception as e:
-            print(f"记录请求日志失败: {e}")
+        except Exception:
+            _log.warning("记录请求日志失败", exc_info=True)
             return False
     
     async def log_response(self, user_id: str, session_id: str, response_data: Dict[str, Any], request_id: str = None) -> bool:
         """记录响应日志"""
-        if not self.config.log_responses or self._collection is None:
+        if not self.is_enabled("response"):
             return False
         
         try:
-            document = {
-                "user_id": user_id,
-                "session_id": session_id,
-                "log_type": "response",
-                "data": response_data,
-                "request_id": request_id,
-                "timestamp": datetime.utcnow()
-            }
+            document = self._pool.pop() if self._pool else {}
+            document.update(
+                user_id=user_id,
+                session_id=session_id,
+                log_type="response",
+                data=response_data,
+                request_id=request_id,
+                timestamp=self._clock.now()
+            )
             
-            await self._collection.insert_one(document)
+            self._queue.put_nowait(document)
             return True
-        except Exception as e:
-            print(f"记录响应日志失败: {e}")
+        except Exception:
+            _log.warning("记录响应日志失败", exc_info=True)
             return False
     
     async def log_error(self, user_id: str, session_id: str, error_data: Dict[str, Any]) -> bool:
         """记录错误日志"""
-        if not self.config.log_errors or self._collection is None:
+        if not self.is_enabled("error"):
             return False
         
         try:
-            document = {
-                "user_id": user_id,
-                "session_id": session_id,
-                "log_type": "error",
-                "data": error_data,
-                "timestamp": datetime.utcnow()
-            }
+            document = self._pool.pop() if self._pool else {}
+            document.update(
+                user_id=user_id,
+                session_id=session_id,
+                log_type="error",
+                data=error_data,
+                timestamp=self._clock.now()
+            )
             
-            await self._collection.insert_one(document)
+            self._queue.put_nowait(document)
             return True
-        except Exception as e:
-            print(f"记录错误日志失败: {e}")
+        except Exception:
+            _log.warning("记录错误日志失败", exc_info=True)
             return False
     
-    async def get_logs(self, user_id: str = None, session_id: str = None, start_time: datetime = None, end_time: datetime = None, limit: int = 100) -> List[Dict[str, Any]]:
-        """获取日志记录"""
+    async def get_logs(self, user_id: str = None, session_id: str = None, start_time: datetime = None, end_time: datetime = None, limit: int = 100, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """获取日志记录
+        
+        fields 指定返回的字段（默认全部），例如不需要 data 时可省略以减少传输和解码开销。
+        """
         if self._collection is None:
             return []
         
@@ -488,25 +788,105 @@ class MongoLogStorage(LogStorage):
                     time_query["$lte"] = end_time
                 query["timestamp"] = time_query
             
-            cursor = self._collection.find(query).sort("timestamp", -1).limit(limit)
+            fields = fields or _LOG_FIELDS
+            projection = {"_id": 0, **{name: 1 for name in fields}}
+            cursor = self._collection.find(query, projection).sort("timestamp", -1).limit(limit)
             
             logs = []
             async for doc in cursor:
-                logs.append({
-                    "user_id": doc["user_id"],
-                    "session_id": doc["session_id"],
-                    "log_type": doc["log_type"],
-                    "data": doc["data"],
-                    "timestamp": doc["timestamp"],
-                    "request_id": doc.get("request_id")
-                })
+                logs.append({name: doc.get(name) for name in fields})
             
             return logs
-        except Exception as e:
-            print(f"获取日志记录失败: {e}")
+        except Exception:
+            _log.warning("获取日志记录失败", exc_info=True)
             return []
     
+    async def _flusher(self) -> None:
+        """后台任务：聚合队列中的日志并批量写入，收到 None 时写完剩余日志后退出"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            document = await self._queue.get()
+            if document is None:
+                break
+            batch = [document]
+            deadline = loop.time() + self.FLUSH_INTERVAL
+            while len(batch) < self.BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    document = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if document is None:
+                    stopping = True
+                    break
+                batch.append(document)
+            await self._write_batch(batch)
+    
+    async def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """批量写入日志"""
+        try:
+            await self._collection.insert_many(batch, ordered=False)
+        except Exception:
+            _log.warning("批量写入日志失败", exc_info=True)
+        finally:
+            for document in batch:
+                document.clear()
+            self._pool.extend(batch)
+    
     async def close(self) -> None:
-        """关闭连接"""
+        """写入剩余日志并关闭连接"""
+        if self._flusher_task:
+            self._queue.put_nowait(None)
+            await self._flusher_task
+            self._flusher_task = None
+            self._queue = None
         if self._client:
-            self._client.close()
\ No newline at end of file
+            _release_mongo_client(self.config.mongo_uri)
+            self._client = None
+
+
+# ============= 存储后端注册表 =============
+
+# 存储类别 -> {storage_type: (模块名, 类名)}，首次获取时才导入对应模块
+_STORAGE_REGISTRY: Dict[str, Dict[str, Tuple[str, str]]] = {
+    "memory": {"mongodb": (__name__, "MongoMemoryStorage")},
+    "log": {"mongodb": (__name__, "MongoLogStorage")},
+}
+_STORAGE_CLASS_CACHE: Dict[Tuple[str, str], type] = {}
+
+
+def register_storage(category: str, storage_type: str, module: str, class_name: str) -> None:
+    """注册存储后端（category 为 "memory" 或 "log"），实现类在首次使用时才导入"""
+    _STORAGE_REGISTRY.setdefault(category, {})[storage_type] = (module, class_name)
+    _STORAGE_CLASS_CACHE.pop((category, storage_type), None)
+
+
+def get_storage_class(category: str, storage_type: str) -> Optional[type]:
+    """获取已注册的存储实现类，未注册时返回None"""
+    key = (category, storage_type)
+    storage_class = _STORAGE_CLASS_CACHE.get(key)
+    if storage_class is None:
+        target = _STORAGE_REGISTRY.get(category, {}).get(storage_type)
+        if target is None:
+            return None
+        module, class_name = target
+        storage_class = getattr(importlib.import_module(module), class_name)
+        _STORAGE_CLASS_CACHE[key] = storage_class
+    return storage_class
+
+
+# ============= 测试代码 =============
+
+if __name__ == "__main__":
+    # to_dict 每次返回新的字典：修改结果不影响之后的调用
+    config = QianwenConfig()
+    result = config.to_dict()
+    result["api"]["api_key"] = "***"
+    result["model"]["available_models"].append("changed")
+    assert config.to_dict() == QianwenConfig().to_dict()
+    assert config.to_dict()["api"] is not config.to_dict()["api"]
+    assert QianwenConfig.from_dict(config.to_dict()) == config
+    print("配置序列化检查通过")
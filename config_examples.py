@@ -10,10 +10,23 @@
 """
 
 import asyncio
-import json
+import gzip
+import os
+import re
+import struct
+import time
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, List, Any, Optional
-from dataclasses import dataclass
+from collections import OrderedDict, deque
+from dataclasses import dataclass, replace
+
+import orjson
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # 导入配置系统
 from config import (
@@ -25,146 +38,372 @@ from qianwen_client_enhanced import QianwenClient
 
 # ============= 自定义记忆存储示例 =============
 
+# Redis消息帧：角色编号(1B) + 时间戳纳秒(8B) + 内容长度(4B) + 内容 + 元数据JSON（可为空）
+# 角色编号为 _ROLE_OTHER 时，帧头后紧跟 1B 角色名长度 + 角色名
+_FRAME_HEADER = struct.Struct('<BQI')
+_ROLE_IDS = {'user': 0, 'assistant': 1, 'system': 2, 'tool': 3}
+_ROLE_NAMES = {role_id: role for role, role_id in _ROLE_IDS.items()}
+_ROLE_OTHER = 255
+
+_time_ns = time.time_ns
+
+
+def _pack_message(role: str, content: str, timestamp_ns: int, metadata: Optional[Dict[str, Any]]) -> bytes:
+    """将消息打包为二进制帧"""
+    content_bytes = content.encode('utf-8')
+    role_id = _ROLE_IDS.get(role, _ROLE_OTHER)
+    frame = _FRAME_HEADER.pack(role_id, timestamp_ns, len(content_bytes))
+    if role_id == _ROLE_OTHER:
+        role_bytes = role.encode('utf-8')
+        frame += bytes((len(role_bytes),)) + role_bytes
+    return frame + content_bytes + (orjson.dumps(metadata) if metadata else b'')
+
+
+def _unpack_message(frame: bytes) -> Dict[str, Any]:
+    """解析二进制帧为消息字典"""
+    role_id, timestamp_ns, content_len = _FRAME_HEADER.unpack_from(frame)
+    offset = _FRAME_HEADER.size
+    if role_id == _ROLE_OTHER:
+        role_len = frame[offset]
+        role = frame[offset + 1:offset + 1 + role_len].decode('utf-8')
+        offset += 1 + role_len
+    else:
+        role = _ROLE_NAMES[role_id]
+    content = frame[offset:offset + content_len].decode('utf-8')
+    metadata_bytes = frame[offset + content_len:]
+    return {
+        "role": role,
+        "content": content,
+        "timestamp": datetime.fromtimestamp(timestamp_ns / 1e9),
+        "metadata": orjson.loads(metadata_bytes) if metadata_bytes else {}
+    }
+
+
 class RedisMemoryStorage(MemoryStorage):
-    """Redis记忆存储实现示例"""
+    """Redis记忆存储实现示例
+    
+    每个会话一个Redis列表（LPUSH，最新消息在表头），元素为紧凑的二进制消息帧。
+    所有命令共用一个长连接客户端（开启keepalive与健康检查），不再单独维护连接池；
+    保存消息时 LPUSH 与 EXPIRE 通过同一个pipeline一次往返发送，其余命令直接发送。
+    """
+    
+    # 键中包含帧格式版本，格式变更时不会误读旧数据
+    KEY_PREFIX = "memory:v2"
+    
+    HEALTH_CHECK_INTERVAL = 30  # 秒
     
     def __init__(self, config: MemoryConfig):
         self.config = config
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise ImportError("请安装redis库: pip install redis")
+        self._aioredis = aioredis
         self.redis_client = None
-        # 这里应该初始化Redis客户端
-        # import redis
-        # self.redis_client = redis.Redis(host='localhost', port=6379, db=0)
     
     async def initialize(self) -> bool:
         """初始化存储"""
         print("初始化Redis记忆存储...")
-        # 这里应该测试Redis连接
-        return True
+        self.redis_client = self._aioredis.Redis(
+            host=self.config.redis_host,
+            port=self.config.redis_port,
+            db=self.config.redis_db,
+            password=self.config.redis_password,
+            decode_responses=False,
+            socket_keepalive=True,
+            health_check_interval=self.HEALTH_CHECK_INTERVAL
+        )
+        try:
+            await self.redis_client.ping()
+            return True
+        except Exception as e:
+            print(f"Redis连接失败: {e}")
+            return False
     
     async def save_message(self, user_id: str, session_id: str, role: str, content: str, metadata: Dict[str, Any] = None):
         """保存消息"""
-        key = f"memory:{user_id}:{session_id}"
-        message_data = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat(),
-            "metadata": metadata or {}
-        }
+        key = f"{self.KEY_PREFIX}:{user_id}:{session_id}"
+        frame = _pack_message(role, content, _time_ns(), metadata)
         
-        # 模拟Redis操作
-        print(f"保存消息到Redis: {key} -> {message_data}")
-        # self.redis_client.lpush(key, json.dumps(message_data))
-        # self.redis_client.expire(key, self.config.ttl_seconds)
+        # LPUSH + EXPIRE 合并为一次往返
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.lpush(key, frame)
+            if self.config.ttl_hours > 0:
+                pipe.expire(key, self.config.ttl_hours * 3600)
+            await pipe.execute()
     
     async def get_history(self, user_id: str, session_id: str, limit: int = None) -> List[Dict[str, Any]]:
         """获取历史记录"""
-        key = f"memory:{user_id}:{session_id}"
-        print(f"从Redis获取历史记录: {key}")
+        key = f"{self.KEY_PREFIX}:{user_id}:{session_id}"
+        limit = limit or self.config.max_history_length
         
-        # 模拟返回数据
-        return [
-            {
-                "role": "user",
-                "content": "你好",
-                "timestamp": datetime.now(),
-                "metadata": {}
-            },
-            {
-                "role": "assistant",
-                "content": "你好！有什么可以帮助你的吗？",
-                "timestamp": datetime.now(),
-                "metadata": {}
-            }
-        ]
+        # 表头为最新消息，取最近的limit条后反转为时间正序
+        raw_messages = await self.redis_client.lrange(key, 0, limit - 1 if limit > 0 else -1)
+        return [_unpack_message(frame) for frame in reversed(raw_messages)]
     
     async def clear_history(self, user_id: str, session_id: str):
         """清除历史记录"""
-        key = f"memory:{user_id}:{session_id}"
-        print(f"清除Redis历史记录: {key}")
-        # self.redis_client.delete(key)
+        key = f"{self.KEY_PREFIX}:{user_id}:{session_id}"
+        await self.redis_client.delete(key)
     
     async def close(self):
         """关闭存储"""
         print("关闭Redis记忆存储")
-        # if self.redis_client:
-        #     self.redis_client.close()
+        if self.redis_client:
+            await self.redis_client.aclose()
+            self.redis_client = None
+
+
+def _read_tail_lines(f, limit: int, block_size: int = 64 * 1024) -> List[bytes]:
+    """从二进制文件末尾读取最后limit个非空行，窗口不足时按倍数扩大"""
+    size = f.seek(0, os.SEEK_END)
+    window = block_size
+    while True:
+        start = max(0, size - window)
+        f.seek(start)
+        lines = f.read(size - start).split(b'\n')
+        if start > 0:
+            # 窗口起点可能落在行中间，丢弃不完整的第一行
+            lines = lines[1:]
+        lines = [line for line in lines if line.strip()]
+        if len(lines) >= limit or start == 0:
+            return lines[-limit:]
+        window *= 2
+
+
+# 归档分段的压缩格式：安装了zstandard时使用zstd，否则使用标准库gzip
+_SEGMENT_SUFFIX = ".zst" if zstandard is not None else ".gz"
+
+
+def _compress_segment(data: bytes) -> bytes:
+    """压缩归档分段"""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data)
+
+
+def _read_segment_lines(path: Path) -> List[bytes]:
+    """读取归档分段的全部非空行，按扩展名选择解压方式"""
+    data = path.read_bytes()
+    if path.suffix == ".part":
+        # 已从当前文件移出、尚未压缩完成的分段
+        pass
+    elif path.suffix == ".zst":
+        if zstandard is None:
+            raise ImportError("读取zstd归档需要安装zstandard库: pip install zstandard")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = gzip.decompress(data)
+    return [line for line in data.split(b'\n') if line.strip()]
+
+
+def _to_datetime(timestamp: Any) -> Any:
+    """把文件中的时间戳（纳秒整数，旧文件中为ISO字符串）转换为datetime"""
+    if isinstance(timestamp, int):
+        return datetime.fromtimestamp(timestamp / 1e9)
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp)
+    return timestamp
+
+
+class _MessageView(dict):
+    """文件记忆存储返回的消息字典
+    
+    timestamp 保存文件中的原始值，通过 [] 或 get() 取值时才转换为datetime，
+    读取历史时不再逐条转换调用方用不到的时间戳。
+    """
+    
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        return _to_datetime(value) if key == 'timestamp' else value
+    
+    def get(self, key, default=None):
+        return self[key] if key in self else default
 
 
 class FileMemoryStorage(MemoryStorage):
-    """文件记忆存储实现示例"""
+    """文件记忆存储实现示例
+    
+    每个会话一个JSON Lines文件（每行一条消息），保存消息只追加一行，不重写整个文件。
+    文件超过 SEGMENT_SIZE 后整体压缩为只读的归档分段（zstd或gzip），之后写入新的文件，
+    读取最近消息时只在当前文件不足时才解压归档分段。
+    最近访问的 MAX_SESSIONS 个会话在内存中保留最后 max_history_length 条消息，
+    读取历史时直接命中缓存，不再解析文件。
+    """
+    
+    MAX_SESSIONS = 1024
+    SEGMENT_SIZE = 1 << 20  # 字节
     
     def __init__(self, config: MemoryConfig):
         self.config = config
-        self.storage_dir = getattr(config, 'storage_dir', './memory_data')
-        import os
-        os.makedirs(self.storage_dir, exist_ok=True)
+        self.storage_dir = Path(getattr(config, 'storage_dir', './memory_data'))
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # (user_id, session_id) -> 文件路径
+        self._path_cache: Dict[tuple, Path] = {}
+        # (user_id, session_id) -> 归档分段路径（按时间顺序）
+        self._segments: Dict[tuple, List[Path]] = {}
+        # (user_id, session_id) -> 最近消息，按LRU顺序淘汰
+        self._cache: OrderedDict = OrderedDict()
     
     async def initialize(self) -> bool:
         """初始化存储"""
         print(f"初始化文件记忆存储: {self.storage_dir}")
         return True
     
-    def _get_file_path(self, user_id: str, session_id: str) -> str:
+    def _get_file_path(self, user_id: str, session_id: str) -> Path:
         """获取文件路径"""
-        import os
-        return os.path.join(self.storage_dir, f"{user_id}_{session_id}.json")
+        key = (user_id, session_id)
+        path = self._path_cache.get(key)
+        if path is None:
+            path = self._path_cache[key] = self.storage_dir / f"{user_id}_{session_id}.jsonl"
+        return path
+    
+    def _get_segments(self, user_id: str, session_id: str) -> List[Path]:
+        """获取会话的归档分段，首次访问时扫描目录"""
+        key = (user_id, session_id)
+        segments = self._segments.get(key)
+        if segments is None:
+            # 只匹配 <会话文件名>.<6位序号>.jsonl.(gz|zst|part)，避免匹配到以本会话ID为前缀的其他会话
+            pattern = re.compile(
+                re.escape(self._get_file_path(user_id, session_id).stem) + r"\.(\d{6})\.jsonl\.(?:gz|zst|part)"
+            )
+            by_index: Dict[str, Path] = {}
+            for path in self.storage_dir.iterdir():
+                match = pattern.fullmatch(path.name)
+                # 同一序号同时存在未压缩和已压缩文件时（压缩后未及删除），使用压缩文件
+                if match and (match.group(1) not in by_index or path.suffix != ".part"):
+                    by_index[match.group(1)] = path
+            segments = self._segments[key] = [by_index[index] for index in sorted(by_index)]
+        return segments
+    
+    async def _rotate(self, file_path: Path, segments: List[Path]):
+        """把当前文件归档为新的分段，之后的消息写入新文件
+        
+        当前文件先改名移出（之后的消息写入新文件），压缩在线程中进行，不阻塞事件循环；
+        压缩完成前读取直接使用未压缩的分段。
+        """
+        position = len(segments)
+        pending = file_path.with_name(f"{file_path.stem}.{position + 1:06d}.jsonl.part")
+        os.replace(file_path, pending)
+        segments.append(pending)
+        segment = await asyncio.to_thread(self._compress_pending, pending)
+        if position < len(segments) and segments[position] == pending:
+            segments[position] = segment
+        print(f"归档历史记录分段: {segment}")
+    
+    @staticmethod
+    def _compress_pending(pending: Path) -> Path:
+        """压缩移出的分段文件，完成后删除未压缩文件"""
+        segment = pending.with_name(pending.stem + _SEGMENT_SUFFIX)
+        tmp_path = segment.with_name(segment.name + ".tmp")
+        tmp_path.write_bytes(_compress_segment(pending.read_bytes()))
+        os.replace(tmp_path, segment)
+        pending.unlink()
+        return segment
+    
+    def _read_lines(self, user_id: str, session_id: str, limit: int = None) -> Optional[List[bytes]]:
+        """读取会话最后limit行（未指定时读取全部），当前文件不足时向前读取归档分段
+        
+        会话不存在时返回None。
+        """
+        file_path = self._get_file_path(user_id, session_id)
+        segments = self._get_segments(user_id, session_id)
+        try:
+            with open(file_path, 'rb') as f:
+                # 指定limit时从文件末尾向前读取，读取量与limit成正比而非与会话长度成正比
+                lines = _read_tail_lines(f, limit) if limit else f.readlines()
+        except FileNotFoundError:
+            if not segments:
+                return None
+            lines = []
+        for segment in reversed(segments):
+            if limit and len(lines) >= limit:
+                break
+            lines = _read_segment_lines(segment) + lines
+        return lines[-limit:] if limit else lines
+    
+    def _cache_put(self, key: tuple, messages: deque):
+        """放入缓存，超出 MAX_SESSIONS 时淘汰最久未访问的会话"""
+        self._cache[key] = messages
+        if len(self._cache) > self.MAX_SESSIONS:
+            self._cache.popitem(last=False)
+    
+    @staticmethod
+    def _parse_lines(lines: List[bytes]) -> List[Dict[str, Any]]:
+        """解析JSON Lines，时间戳在取值时才转换"""
+        return [_MessageView(orjson.loads(line)) for line in lines if line.strip()]
     
     async def save_message(self, user_id: str, session_id: str, role: str, content: str, metadata: Dict[str, Any] = None):
         """保存消息"""
         file_path = self._get_file_path(user_id, session_id)
         
-        # 读取现有数据
-        messages = []
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                messages = json.load(f)
-        except FileNotFoundError:
-            pass
-        
-        # 添加新消息
         message_data = {
             "role": role,
             "content": content,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": _time_ns(),  # 纳秒整数，取值时再转换为datetime
             "metadata": metadata or {}
         }
-        messages.append(message_data)
         
-        # 保存到文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
+        # 追加一行到文件，超过分段大小时归档
+        with open(file_path, 'ab') as f:
+            f.write(orjson.dumps(message_data, option=orjson.OPT_APPEND_NEWLINE))
+            size = f.tell()
+        if size >= self.SEGMENT_SIZE:
+            await self._rotate(file_path, self._get_segments(user_id, session_id))
+        
+        # 已缓存的会话同步追加；未缓存的会话等首次读取时再加载
+        cached = self._cache.get((user_id, session_id))
+        if cached is not None:
+            cached.append(_MessageView(message_data))
         
         print(f"保存消息到文件: {file_path}")
     
     async def get_history(self, user_id: str, session_id: str, limit: int = None) -> List[Dict[str, Any]]:
         """获取历史记录"""
+        key = (user_id, session_id)
         file_path = self._get_file_path(user_id, session_id)
+        window = self.config.max_history_length
         
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                messages = json.load(f)
-            
-            # 转换时间戳
-            for msg in messages:
-                if isinstance(msg.get('timestamp'), str):
-                    msg['timestamp'] = datetime.fromisoformat(msg['timestamp'])
-            
-            if limit:
-                messages = messages[-limit:]
-            
-            print(f"从文件获取历史记录: {file_path}, 共{len(messages)}条")
-            return messages
-            
-        except FileNotFoundError:
+        # 缓存只保留最后window条，超出窗口的读取仍走文件
+        if limit and limit <= window:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return list(cached)[-limit:]
+        
+        # 可缓存的读取按窗口大小读取，结果放入缓存
+        cacheable = bool(limit) and limit <= window
+        lines = self._read_lines(user_id, session_id, window if cacheable else limit)
+        
+        if lines is None:
             print(f"历史记录文件不存在: {file_path}")
+            if cacheable:
+                # 新会话也放入缓存，后续消息直接追加
+                self._cache_put(key, deque(maxlen=window))
             return []
+        
+        if cacheable:
+            cached = deque(self._parse_lines(lines), maxlen=window)
+            self._cache_put(key, cached)
+            messages = list(cached)[-limit:]
+        else:
+            messages = self._parse_lines(lines)
+        
+        print(f"从文件获取历史记录: {file_path}, 共{len(messages)}条")
+        return messages
     
     async def clear_history(self, user_id: str, session_id: str):
         """清除历史记录"""
         file_path = self._get_file_path(user_id, session_id)
+        self._cache.pop((user_id, session_id), None)
+        segments = self._get_segments(user_id, session_id)
+        for segment in segments:
+            segment.unlink(missing_ok=True)
+        segments.clear()
         try:
-            import os
-            os.remove(file_path)
+            file_path.unlink()
             print(f"清除文件历史记录: {file_path}")
         except FileNotFoundError:
             pass
@@ -176,77 +415,160 @@ class FileMemoryStorage(MemoryStorage):
 
 # ============= 自定义日志存储示例 =============
 
+# 日志类型 -> 提示文字
+_LOG_TYPE_NAMES = {"request": "请求", "response": "响应", "error": "错误"}
+
+_LOG_OPEN_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_CLOEXEC', 0)
+
+
 class FileLogStorage(LogStorage):
-    """文件日志存储实现示例"""
+    """文件日志存储实现示例
+    
+    日志行交给后台写入任务，文件描述符（O_APPEND）按日志类型复用。写入任务把 BATCH_WINDOW 秒内
+    （最多 BATCH_SIZE 条）到达的日志合并，每个文件一次写入，调用方不阻塞在文件IO上。
+    """
+    
+    BATCH_SIZE = 256
+    BATCH_WINDOW = 0.005  # 秒
     
     def __init__(self, config: LogConfig):
         self.config = config
-        self.log_dir = getattr(config, 'log_dir', './log_data')
-        import os
-        os.makedirs(self.log_dir, exist_ok=True)
+        self.log_dir = Path(getattr(config, 'log_dir', './log_data'))
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # 日志类型 -> (文件路径, 文件描述符)
+        self._fds: Dict[str, tuple] = {}
+        # 当天的日志文件路径缓存，日期变化时重建
+        self._date_str: Optional[str] = None
+        self._log_files: Dict[str, Path] = {}
+        # 当前秒及其格式化结果（精确到秒的ISO前缀）
+        self._iso_sec: Optional[int] = None
+        self._iso_prefix = ""
     
     async def initialize(self) -> bool:
         """初始化存储"""
         print(f"初始化文件日志存储: {self.log_dir}")
+        self._start_writer()
         return True
     
-    def _get_log_file(self, log_type: str) -> str:
-        """获取日志文件路径"""
-        import os
-        date_str = datetime.now().strftime('%Y%m%d')
-        return os.path.join(self.log_dir, f"{log_type}_{date_str}.json")
+    def _start_writer(self):
+        """启动后台写入任务"""
+        if self._writer_task is None:
+            self._queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer())
     
-    async def log_request(self, user_id: str, session_id: str, request_data: Dict[str, Any]):
-        """记录请求日志"""
-        log_file = self._get_log_file('request')
+    def _timestamp(self) -> str:
+        """生成精确到微秒的ISO 8601时间戳
         
+        秒级部分每秒只格式化一次，其余时间只拼接微秒；日期变化时同时重建日志文件路径缓存。
+        """
+        sec, usec = divmod(_time_ns() // 1000, 1_000_000)
+        if sec != self._iso_sec:
+            self._iso_sec = sec
+            now = datetime.fromtimestamp(sec)
+            self._iso_prefix = now.strftime('%Y-%m-%dT%H:%M:%S.')
+            date_str = now.strftime('%Y%m%d')
+            if date_str != self._date_str:
+                self._date_str = date_str
+                self._log_files = {}
+        return f"{self._iso_prefix}{usec:06d}"
+    
+    def _get_log_file(self, log_type: str) -> Path:
+        """获取当天的日志文件路径（日期由 _timestamp 维护）"""
+        log_file = self._log_files.get(log_type)
+        if log_file is None:
+            log_file = self._log_files[log_type] = self.log_dir / f"{log_type}_{self._date_str}.json"
+        return log_file
+    
+    def _write(self, log_type: str, user_id: str, session_id: str, payload_key: str, payload: Dict[str, Any], extra: Dict[str, Any] = None) -> Path:
+        """组装日志条目、序列化并交给后台任务写入，返回目标文件路径"""
         log_entry = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._timestamp(),
             "user_id": user_id,
-            "session_id": session_id,
-            "request_data": request_data
+            "session_id": session_id
         }
+        if extra:
+            log_entry.update(extra)
+        log_entry[payload_key] = payload
+        
+        self._start_writer()
+        log_file = self._get_log_file(log_type)
+        self._queue.put_nowait((log_type, log_file, orjson.dumps(log_entry, option=orjson.OPT_APPEND_NEWLINE)))
+        print(f"记录{_LOG_TYPE_NAMES[log_type]}日志到文件: {log_file}")
+        return log_file
+    
+    def _get_fd(self, log_type: str, log_file: Path) -> int:
+        """获取日志文件描述符，日期切换时关闭旧文件
         
-        # 追加到文件
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+        以 O_APPEND 打开，每次写入由内核原子地定位到文件末尾，多个进程写同一文件也不会互相覆盖。
+        """
+        current = self._fds.get(log_type)
+        # 同一天的路径来自 _log_files 缓存，是同一个对象
+        if current and current[0] is log_file:
+            return current[1]
+        if current:
+            os.close(current[1])
+        fd = os.open(log_file, _LOG_OPEN_FLAGS, 0o644)
+        self._fds[log_type] = (log_file, fd)
+        return fd
+    
+    def _write_batch(self, batch: List[tuple]):
+        """按文件合并一批日志行，每个文件一次写入并刷新"""
+        grouped: Dict[tuple, List[bytes]] = {}
+        for log_type, log_file, line in batch:
+            grouped.setdefault((log_type, log_file), []).append(line)
+        for (log_type, log_file), lines in grouped.items():
+            fd = self._get_fd(log_type, log_file)
+            data = memoryview(b''.join(lines))
+            # 无用户态缓冲，一次系统调用写入；仅在被截断时补写剩余部分
+            while data:
+                data = data[os.write(fd, data):]
+    
+    def _close_files(self):
+        """落盘并关闭所有文件描述符"""
+        for _, fd in self._fds.values():
+            os.fsync(fd)
+            os.close(fd)
+        self._fds.clear()
+    
+    async def _writer(self):
+        """后台任务：合并日志行并批量写入，收到 None 时写完剩余日志、关闭文件后退出"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.BATCH_WINDOW
+            while len(batch) < self.BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await asyncio.to_thread(self._write_batch, batch)
         
-        print(f"记录请求日志到文件: {log_file}")
+        await asyncio.to_thread(self._close_files)
+    
+    async def log_request(self, user_id: str, session_id: str, request_data: Dict[str, Any]):
+        """记录请求日志"""
+        self._write('request', user_id, session_id, 'request_data', request_data)
     
     async def log_response(self, user_id: str, session_id: str, response_data: Dict[str, Any], request_id: str = None):
         """记录响应日志"""
-        log_file = self._get_log_file('response')
-        
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "user_id": user_id,
-            "session_id": session_id,
-            "request_id": request_id,
-            "response_data": response_data
-        }
-        
-        # 追加到文件
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
-        
-        print(f"记录响应日志到文件: {log_file}")
+        self._write('response', user_id, session_id, 'response_data', response_data, {"request_id": request_id})
     
     async def log_error(self, user_id: str, session_id: str, error_data: Dict[str, Any]):
         """记录错误日志"""
-        log_file = self._get_log_file('error')
-        
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "user_id": user_id,
-            "session_id": session_id,
-            "error_data": error_data
-        }
-        
-        # 追加到文件
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
-        
-        print(f"记录错误日志到文件: {log_file}")
+        self._write('error', user_id, session_id, 'error_data', error_data)
     
     async def get_logs(self, user_id: str = None, session_id: str = None, start_time: datetime = None, end_time: datetime = None, limit: int = 100) -> List[Dict[str, Any]]:
         """获取日志记录"""
@@ -255,7 +577,12 @@ class FileLogStorage(LogStorage):
         return []
     
     async def close(self):
-        """关闭存储"""
+        """写入剩余日志并关闭存储"""
+        if self._writer_task:
+            self._queue.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+            self._queue = None
         print("关闭文件日志存储")
 
 
@@ -295,10 +622,10 @@ def example_custom_memory_config():
         max_history_length=50
     )
     
-    # 设置自定义存储实现
-    memory_config.custom_storage = FileMemoryStorage(memory_config)
+    # 设置自定义存储实现（配置对象不可变，使用replace生成新配置）
+    memory_config = replace(memory_config, custom_storage=FileMemoryStorage(memory_config))
     # 或者使用Redis存储
-    # memory_config.custom_storage = RedisMemoryStorage(memory_config)
+    # memory_config = replace(memory_config, custom_storage=RedisMemoryStorage(memory_config))
     
     config = QianwenConfig(
         api=APIConfig(
@@ -322,8 +649,8 @@ def example_custom_log_config():
         storage_type="custom"
     )
     
-    # 设置自定义存储实现
-    log_config.custom_storage = FileLogStorage(log_config)
+    # 设置自定义存储实现（配置对象不可变，使用replace生成新配置）
+    log_config = replace(log_config, custom_storage=FileLogStorage(log_config))
     
     config = QianwenConfig(
         api=APIConfig(
@@ -347,14 +674,14 @@ def example_full_custom_config():
         storage_type="custom",
         max_history_length=30
     )
-    memory_config.custom_storage = FileMemoryStorage(memory_config)
+    memory_config = replace(memory_config, custom_storage=FileMemoryStorage(memory_config))
     
     # 自定义日志存储
     log_config = LogConfig(
         enabled=True,
         storage_type="custom"
     )
-    log_config.custom_storage = FileLogStorage(log_config)
+    log_config = replace(log_config, custom_storage=FileLogStorage(log_config))
     
     config = QianwenConfig(
         api=APIConfig(
@@ -391,14 +718,14 @@ def example_dict_config():
             "enabled": True,
             "storage_type": "mongodb",
             "max_history_length": 20,
-            "mongodb_url": "mongodb://localhost:27017",
-            "database_name": "qianwen_memory"
+            "mongo_uri": "mongodb://localhost:27017",
+            "mongo_database": "qianwen_memory"
         },
         "log": {
             "enabled": True,
             "storage_type": "mongodb",
-            "mongodb_url": "mongodb://localhost:27017",
-            "database_name": "qianwen_logs"
+            "mongo_uri": "mongodb://localhost:27017",
+            "mongo_database": "qianwen_logs"
         }
     }
     return config_dict
@@ -488,10 +815,10 @@ async def example_dict_config_usage():
     """字典配置使用示例"""
     print("\n=== 字典配置使用示例 ===")
     
-    # 使用字典配置
-    config_dict = example_dict_config()
+    # 使用字典配置，一次性转换为配置对象（字段名在此处校验），之后可重复使用
+    config = QianwenConfig.from_dict(example_dict_config())
     
-    async with QianwenClient(config_dict) as client:
+    async with QianwenClient(config) as client:
         chat = client.chat(user_id="user5", session_id="session5")
         
         response = await chat.ask("用字典配置创建的客户端工作正常吗？")
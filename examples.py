@@ -16,239 +16,199 @@
 
 import asyncio
 import os
-from qianwen_client import create_async_client
+from qianwen_client_enhanced import create_async_client, install_uvloop
 
 
-async def basic_chat_example():
+async def basic_chat_example(client):
     """基础对话示例"""
     print("\n=== 基础对话示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    # 创建对话
+    chat = client.chat(user_id="user123", session_id="session456")
     
-    try:
-        # 创建对话
-        chat = client.chat(user_id="user123", session_id="session456")
-        
-        # 发送消息
-        response = await chat.ask("你好！请介绍一下你自己。")
-        print(f"AI: {response['choices'][0]['message']['content']}")
-        
-    finally:
-        await client.close()
+    # 发送消息
+    response = await chat.ask("你好！请介绍一下你自己。")
+    print(f"AI: {response['choices'][0]['message']['content']}")
 
 
-async def chain_call_example():
+async def chain_call_example(client):
     """链式调用示例"""
     print("\n=== 链式调用示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    # 链式设置参数并发送消息
+    response = await client.chat(user_id="user123", session_id="chain_demo") \
+        .model("qwen-plus") \
+        .temperature(0.8) \
+        .max_tokens(500) \
+        .system("你是一个专业的AI助手，请用简洁的语言回答问题") \
+        .ask("请用3句话介绍人工智能的发展历程")
     
-    try:
-        # 链式设置参数并发送消息
-        response = await client.chat(user_id="user123") \
-            .model("qwen-plus") \
-            .temperature(0.8) \
-            .max_tokens(500) \
-            .system("你是一个专业的AI助手，请用简洁的语言回答问题") \
-            .ask("请用3句话介绍人工智能的发展历程")
-        
-        print(f"AI: {response['choices'][0]['message']['content']}")
-        
-    finally:
-        await client.close()
+    print(f"AI: {response['choices'][0]['message']['content']}")
 
 
-async def stream_chat_example():
+async def stream_chat_example(client):
     """流式对话示例"""
     print("\n=== 流式对话示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    chat = client.chat(user_id="user123", session_id="stream_demo")
     
-    try:
-        chat = client.chat(user_id="user123")
-        
-        print("AI: ", end="", flush=True)
-        async for chunk in chat.stream("请写一首关于春天的短诗"):
-            if chunk.choices and chunk.choices[0].delta.content:
-                print(chunk.choices[0].delta.content, end="", flush=True)
-        print()  # 换行
-        
-    finally:
-        await client.close()
+    print("AI: ", end="", flush=True)
+    async for chunk in chat.stream("请写一首关于春天的短诗"):
+        if chunk.choices and chunk.choices[0].delta.content:
+            print(chunk.choices[0].delta.content, end="", flush=True)
+    print()  # 换行
 
 
-async def image_understanding_example():
+async def image_understanding_example(client):
     """图像理解示例"""
     print("\n=== 图像理解示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    chat = client.chat(user_id="user123", session_id="image_demo")
     
-    try:
-        chat = client.chat(user_id="user123")
-        
-        # 注意：这里需要替换为实际的图片路径
-        image_path = "example_image.jpg"
-        
-        if os.path.exists(image_path):
-            response = await chat.model("qwen-vl-plus").image(
-                "请详细描述这张图片的内容", 
-                image_path
-            )
-            print(f"AI: {response['choices'][0]['message']['content']}")
-        else:
-            print("图片文件不存在，跳过图像理解示例")
-        
-    finally:
-        await client.close()
+    # 注意：这里需要替换为实际的图片路径
+    image_path = "example_image.jpg"
+    
+    if os.path.exists(image_path):
+        response = await chat.model("qwen-vl-plus").image(
+            "请详细描述这张图片的内容", 
+            image_path
+        )
+        print(f"AI: {response['choices'][0]['message']['content']}")
+    else:
+        print("图片文件不存在，跳过图像理解示例")
 
 
-async def search_example():
+async def search_example(client):
     """联网搜索示例"""
     print("\n=== 联网搜索示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    chat = client.chat(user_id="user123")
     
-    try:
-        chat = client.chat(user_id="user123")
-        
-        # 启用搜索功能
-        response = await chat.search(True).ask("今天北京的天气如何？")
-        print(f"AI: {response['choices'][0]['message']['content']}")
-        
-    finally:
-        await client.close()
+    # 启用搜索功能
+    response = await chat.search(True).ask("今天北京的天气如何？")
+    print(f"AI: {response['choices'][0]['message']['content']}")
 
 
-async def memory_example():
+async def memory_example(client):
     """记忆功能示例"""
     print("\n=== 记忆功能示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    chat = client.chat(user_id="user123", session_id="memory_test")
     
-    try:
-        chat = client.chat(user_id="user123", session_id="memory_test")
-        
-        # 第一轮对话
-        print("第一轮对话：")
-        response1 = await chat.ask("我的名字是张三，我喜欢编程")
-        print(f"AI: {response1['choices'][0]['message']['content']}")
-        
-        # 第二轮对话（会记住之前的内容）
-        print("\n第二轮对话：")
-        response2 = await chat.ask("你还记得我的名字和爱好吗？")
-        print(f"AI: {response2['choices'][0]['message']['content']}")
-        
-        # 查看历史记录
-        history = await chat.get_history()
-        print(f"\n历史记录数量: {len(history)}")
-        
-        # 清除记忆
-        await chat.clear_memory()
-        print("已清除记忆")
-        
-        # 测试记忆清除效果
-        print("\n清除记忆后的对话：")
-        response3 = await chat.ask("你还记得我的名字吗？")
-        print(f"AI: {response3['choices'][0]['message']['content']}")
-        
-    finally:
-        await client.close()
+    # 第一轮对话
+    print("第一轮对话：")
+    response1 = await chat.ask("我的名字是张三，我喜欢编程")
+    print(f"AI: {response1['choices'][0]['message']['content']}")
+    
+    # 第二轮对话（会记住之前的内容）
+    print("\n第二轮对话：")
+    response2 = await chat.ask("你还记得我的名字和爱好吗？")
+    print(f"AI: {response2['choices'][0]['message']['content']}")
+    
+    # 查看历史记录
+    history = await chat.get_history()
+    print(f"\n历史记录数量: {len(history)}")
+    
+    # 清除记忆
+    await chat.clear_memory()
+    print("已清除记忆")
+    
+    # 测试记忆清除效果
+    print("\n清除记忆后的对话：")
+    response3 = await chat.ask("你还记得我的名字吗？")
+    print(f"AI: {response3['choices'][0]['message']['content']}")
 
 
-async def user_isolation_example():
+async def user_isolation_example(client):
     """用户隔离示例"""
     print("\n=== 用户隔离示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    # 用户A的对话
+    chat_a = client.chat(user_id="user_a", session_id="session_a")
+    await chat_a.ask("我喜欢蓝色，我是一名教师")
     
-    try:
-        # 用户A的对话
-        chat_a = client.chat(user_id="user_a", session_id="session_a")
-        await chat_a.ask("我喜欢蓝色，我是一名教师")
-        
-        # 用户B的对话
-        chat_b = client.chat(user_id="user_b", session_id="session_b")
-        await chat_b.ask("我喜欢红色，我是一名程序员")
-        
-        # 测试隔离效果
-        print("用户A询问自己的信息：")
-        result_a = await chat_a.ask("我喜欢什么颜色？我的职业是什么？")
-        print(f"用户A: {result_a['choices'][0]['message']['content']}")
-        
-        print("\n用户B询问自己的信息：")
-        result_b = await chat_b.ask("我喜欢什么颜色？我的职业是什么？")
-        print(f"用户B: {result_b['choices'][0]['message']['content']}")
-        
-    finally:
-        await client.close()
+    # 用户B的对话
+    chat_b = client.chat(user_id="user_b", session_id="session_b")
+    await chat_b.ask("我喜欢红色，我是一名程序员")
+    
+    # 测试隔离效果
+    print("用户A询问自己的信息：")
+    result_a = await chat_a.ask("我喜欢什么颜色？我的职业是什么？")
+    print(f"用户A: {result_a['choices'][0]['message']['content']}")
+    
+    print("\n用户B询问自己的信息：")
+    result_b = await chat_b.ask("我喜欢什么颜色？我的职业是什么？")
+    print(f"用户B: {result_b['choices'][0]['message']['content']}")
 
 
-async def document_example():
+async def document_example(client):
     """文档处理示例"""
     print("\n=== 文档处理示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    chat = client.chat(user_id="user123", session_id="document_demo")
     
-    try:
-        chat = client.chat(user_id="user123")
-        
-        # 注意：这里需要替换为实际的文档路径
-        doc_path = "example_document.pdf"
-        
-        if os.path.exists(doc_path):
-            response = await chat.document(
-                "请总结这个文档的主要内容", 
-                doc_path
-            )
-            print(f"AI: {response['choices'][0]['message']['content']}")
-        else:
-            print("文档文件不存在，跳过文档处理示例")
-        
-    finally:
-        await client.close()
+    # 注意：这里需要替换为实际的文档路径
+    doc_path = "example_document.pdf"
+    
+    if os.path.exists(doc_path):
+        response = await chat.document(
+            "请总结这个文档的主要内容", 
+            doc_path
+        )
+        print(f"AI: {response['choices'][0]['message']['content']}")
+    else:
+        print("文档文件不存在，跳过文档处理示例")
 
 
-async def comprehensive_example():
+async def comprehensive_example(client):
     """综合示例：展示多种功能组合使用"""
     print("\n=== 综合示例 ===")
     
-    client = create_async_client()
-    await client.initialize()
+    # 创建一个带记忆的对话会话
+    chat = client.chat(user_id="demo_user", session_id="comprehensive_demo")
     
-    try:
-        # 创建一个带记忆的对话会话
-        chat = client.chat(user_id="demo_user", session_id="comprehensive_demo")
-        
-        # 设置系统提示和参数
-        chat = chat.model("qwen-plus").temperature(0.7).system(
-            "你是一个智能助手，能够记住用户的偏好和历史对话"
-        )
-        
-        # 第一轮：建立用户画像
-        print("建立用户画像：")
-        response1 = await chat.ask("我是一名Python开发者，对AI技术很感兴趣")
-        print(f"AI: {response1['choices'][0]['message']['content']}")
-        
-        # 第二轮：基于记忆的个性化回答
-        print("\n个性化推荐：")
-        response2 = await chat.ask("能推荐一些适合我学习的AI框架吗？")
-        print(f"AI: {response2['choices'][0]['message']['content']}")
-        
-        # 第三轮：联网搜索最新信息
-        print("\n获取最新信息：")
-        response3 = await chat.search(True).ask("最近有什么新的AI技术突破？")
-        print(f"AI: {response3['choices'][0]['message']['content']}")
-        
-    finally:
-        await client.close()
+    # 设置系统提示和参数
+    chat = chat.model("qwen-plus").temperature(0.7).system(
+        "你是一个智能助手，能够记住用户的偏好和历史对话"
+    )
+    # 固定参数，后续多轮对话复用同一个请求模板
+    base = chat.freeze()
+    
+    # 第一轮：建立用户画像
+    print("建立用户画像：")
+    response1 = await base.ask("我是一名Python开发者，对AI技术很感兴趣")
+    print(f"AI: {response1['choices'][0]['message']['content']}")
+    
+    # 第二轮：基于记忆的个性化回答
+    print("\n个性化推荐：")
+    response2 = await base.ask("能推荐一些适合我学习的AI框架吗？")
+    print(f"AI: {response2['choices'][0]['message']['content']}")
+    
+    # 第三轮：联网搜索最新信息
+    print("\n获取最新信息：")
+    response3 = await chat.search(True).ask("最近有什么新的AI技术突破？")
+    print(f"AI: {response3['choices'][0]['message']['content']}")
+
+
+# 同时进行的API请求上限，避免触发接口并发限流
+MAX_CONCURRENT_EXAMPLES = 4
+
+
+async def run_concurrently(*examples):
+    """并发运行互不依赖的示例，同时进行的数量不超过 MAX_CONCURRENT_EXAMPLES
+    
+    单个示例出错时只报告该示例，其余示例继续运行，全部结束后才返回（之后才会关闭共用的客户端）。
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_EXAMPLES)
+    
+    async def run(example):
+        async with semaphore:
+            try:
+                await example
+            except Exception as e:
+                print(f"示例 {example.__qualname__} 运行出错: {e}")
+    
+    await asyncio.gather(*(run(example) for example in examples))
 
 
 async def main():
@@ -263,16 +223,23 @@ async def main():
         return
     
     try:
-        # 运行各种示例
-        await basic_chat_example()
-        await chain_call_example()
-        await stream_chat_example()
-        await image_understanding_example()
-        await search_example()
-        await memory_example()
-        await user_isolation_example()
-        await document_example()
-        await comprehensive_example()
+        # 所有示例共用一个客户端，存储连接只建立和关闭一次
+        async with create_async_client() as client:
+            # 互不依赖的示例并发运行，网络等待相互重叠（输出可能交错）
+            # 并发示例各自使用独立的会话ID，避免默认的按秒生成的会话ID相同而共用记忆
+            await run_concurrently(
+                basic_chat_example(client),
+                chain_call_example(client),
+                stream_chat_example(client),
+                image_understanding_example(client),
+                document_example(client),
+                user_isolation_example(client),
+                comprehensive_example(client),
+            )
+            
+            # 以下示例使用user123的默认会话或依赖上下文记忆，在并发示例结束后按顺序运行
+            await search_example(client)
+            await memory_example(client)
         
         print("\n=== 所有示例运行完成 ===")
         
@@ -282,5 +249,6 @@ async def main():
 
 
 if __name__ == "__main__":
-    # 运行示例
+    # 运行示例（已安装uvloop时使用uvloop事件循环）
+    install_uvloop()
     asyncio.run(main())
\ No newline at end of file
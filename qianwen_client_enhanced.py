@@ -25,19 +25,26 @@
 
 import os
 import base64
+import inspect
 import json
+import logging
+import mmap
+import threading
+import time
 import uuid
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional, Union, AsyncGenerator, Callable
+from typing import Dict, List, Any, Optional, Union, AsyncGenerator, Callable, Tuple
+from itertools import islice
 from pathlib import Path
 import asyncio
-from dataclasses import dataclass, field
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, replace
 from contextlib import asynccontextmanager
 
 # 导入配置系统
 from config import (
     QianwenConfig, APIConfig, ModelConfig, MemoryConfig, LogConfig,
-    MemoryStorage, LogStorage, MongoMemoryStorage, MongoLogStorage
+    MemoryStorage, LogStorage, get_storage_class
 )
 
 # 第三方库
@@ -46,6 +53,17 @@ try:
 except ImportError:
     raise ImportError("请安装openai库: pip install openai")
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401  httpx的HTTP/2支持依赖h2
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
 try:
     import pymongo
     from motor.motor_asyncio import AsyncIOMotorClient
@@ -66,8 +84,15 @@ except ImportError:
 
 try:
     import orjson
+    _json_loads = orjson.loads
+    
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode('utf-8')
 except ImportError:
-    import json as orjson
+    _json_loads = json.loads
+    
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
 
 try:
     from cachetools import TTLCache
@@ -80,6 +105,103 @@ try:
 except ImportError:
     pass
 
+_log = logging.getLogger(__name__)
+
+
+# 联网搜索工具定义（所有启用搜索的请求共用，不可修改）
+_WEB_SEARCH_TOOLS = (
+    {"type": "web_search", "web_search": {"enable": True}},
+)
+
+
+# ============= 文件编码 =============
+
+# 图片文件头 -> MIME类型
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+# 超过该大小（字节）的文件通过mmap编码，避免额外复制一份文件内容
+_MMAP_THRESHOLD = 1 << 20
+
+# 编码结果缓存：只缓存不超过 _MMAP_THRESHOLD 的文件，缓存的base64总长度不超过该值
+_ENCODE_CACHE_MAX_BYTES = 64 << 20
+
+
+def _detect_image_mime(header: bytes) -> str:
+    """根据文件头识别图片MIME类型，无法识别时按JPEG处理"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime
+    return 'image/jpeg'
+
+
+class _EncodeCache:
+    """按base64总长度限制大小的LRU缓存（编码在工作线程中进行，读写加锁）"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: Tuple[str, int, int]) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+    
+    def put(self, key: Tuple[str, int, int], value: Tuple[str, str]):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = value
+            self._bytes += len(value[1])
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[1])
+
+
+_encode_cache = _EncodeCache(_ENCODE_CACHE_MAX_BYTES)
+
+
+def _encode_file(path: str, mtime_ns: int, size: int) -> Tuple[str, str]:
+    """读取文件并编码为base64，返回 (MIME类型, base64字符串)
+    
+    修改时间和大小是缓存键的一部分，文件变化后不会命中旧结果；大文件不缓存。
+    """
+    if size > _MMAP_THRESHOLD:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _detect_image_mime(data[:12]), base64.b64encode(data).decode('ascii')
+    
+    key = (path, mtime_ns, size)
+    result = _encode_cache.get(key)
+    if result is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        result = _detect_image_mime(data[:12]), base64.b64encode(data).decode('ascii')
+        _encode_cache.put(key, result)
+    return result
+
+
+def _missing_files(paths: List[str]) -> List[str]:
+    """返回不存在的文件路径"""
+    return [path for path in paths if not os.path.exists(path)]
+
+
+def _read_text_file(path: str) -> str:
+    """以UTF-8读取文本文件"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
 
 # ============= 异常定义 =============
 
@@ -98,10 +220,29 @@ class ChatMessage:
     """聊天消息数据类"""
     role: str
     content: Union[str, List[Dict[str, Any]]]
-    timestamp: datetime = field(default_factory=datetime.now)
+    timestamp: float = field(default_factory=time.time)  # Unix时间戳（秒）
     user_id: Optional[str] = None
     session_id: Optional[str] = None
     metadata: Dict[str, Any] = field(default_factory=dict)
+    
+    @property
+    def created_at(self) -> datetime:
+        """消息时间（读取时才转换为datetime）"""
+        return datetime.fromtimestamp(self.timestamp)
+
+
+def _epoch(timestamp: Any) -> float:
+    """把存储中的时间（datetime或数值）转换为Unix时间戳，缺失时取当前时间
+    
+    不带时区的datetime按本地时间处理（存储接口约定，UTC时间需带时区返回）。
+    """
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    if timestamp is None:
+        return time.time()
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp).timestamp()
+    return float(timestamp)
 
 
 # ============= 存储工厂 =============
@@ -118,8 +259,9 @@ class StorageFactory:
         if config.custom_storage:
             return config.custom_storage
         
-        if config.storage_type == "mongodb":
-            return MongoMemoryStorage(config)
+        storage_class = get_storage_class("memory", config.storage_type)
+        if storage_class:
+            return storage_class(config)
         elif config.storage_type == "redis":
             # 这里可以实现Redis存储
             raise NotImplementedError("Redis存储尚未实现，请使用自定义存储")
@@ -138,8 +280,9 @@ class StorageFactory:
         if config.custom_storage:
             return config.custom_storage
         
-        if config.storage_type == "mongodb":
-            return MongoLogStorage(config)
+        storage_class = get_storage_class("log", config.storage_type)
+        if storage_class:
+            return storage_class(config)
         elif config.storage_type == "file":
             # 这里可以实现文件日志存储
             raise NotImplementedError("文件日志存储尚未实现，请使用自定义存储")
@@ -149,6 +292,28 @@ class StorageFactory:
 
 # ============= 记忆管理器 =============
 
+def _serialize_json(content: Any) -> Tuple[str, str]:
+    """序列化为JSON字符串并标记为json类型"""
+    return _json_dumps(content), "json"
+
+
+# 消息内容类型 -> 序列化函数，返回 (存储内容, content_type)；文本原样保存，标记为text
+_CONTENT_SERIALIZERS: Dict[type, Callable[[Any], Tuple[Any, str]]] = {
+    str: lambda content: (content, "text"),
+    list: _serialize_json,
+    dict: _serialize_json,
+}
+
+# 存储时记录内容类型的元数据键（加下划线前缀，不与用户元数据中的 content_type 冲突，读取时去掉）
+_CONTENT_TYPE_KEY = "_content_type"
+
+# content_type -> 反序列化函数
+_CONTENT_PARSERS: Dict[str, Callable[[Any], Any]] = {
+    "text": lambda content: content,
+    "json": _json_loads,
+}
+
+
 class MemoryManager:
     """记忆管理器 - 使用可配置的存储后端"""
     
@@ -156,6 +321,8 @@ class MemoryManager:
         self.config = config
         self.storage = StorageFactory.create_memory_storage(config)
         self._local_cache = None
+        # 本地缓存每个会话最多保留的消息数（0表示不限制）
+        self._history_limit = config.max_history_length or None
         
         # 本地缓存
         if TTLCache and config.enabled:
@@ -170,6 +337,43 @@ class MemoryManager:
             return await self.storage.initialize()
         return True
     
+    @staticmethod
+    def _to_storage(message: ChatMessage) -> Tuple[str, Dict[str, Any]]:
+        """转换为存储格式：非文本内容序列化为JSON，并在元数据中记录内容类型（text或json）"""
+        serializer = _CONTENT_SERIALIZERS.get(type(message.content))
+        if serializer is None:
+            # 文本或列表/字典的子类等不在表中的类型
+            serializer = _CONTENT_SERIALIZERS[str] if isinstance(message.content, str) else _serialize_json
+        content, content_type = serializer(message.content)
+        return content, {**message.metadata, _CONTENT_TYPE_KEY: content_type}
+    
+    @staticmethod
+    def _from_storage(content: Any, metadata: Optional[Dict[str, Any]]) -> Any:
+        """还原存储的内容：带JSON标记时直接解析，带text标记时原样返回
+        
+        没有类型标记的旧记录只在内容以 [ 或 { 开头时尝试解析。
+        """
+        content_type = metadata.get(_CONTENT_TYPE_KEY) if metadata else None
+        if content_type is not None:
+            # 未知的类型标记按原样返回
+            parser = _CONTENT_PARSERS.get(content_type)
+            return parser(content) if parser is not None else content
+        if isinstance(content, str) and content[:1] in ('[', '{'):
+            try:
+                return _json_loads(content)
+            except json.JSONDecodeError:
+                pass
+        return content
+    
+    @staticmethod
+    def _user_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """还原用户的元数据：去掉内容类型标记，返回新的普通字典"""
+        if not metadata:
+            return {}
+        if _CONTENT_TYPE_KEY in metadata:
+            return {key: value for key, value in metadata.items() if key != _CONTENT_TYPE_KEY}
+        return dict(metadata)
+    
     async def save_message(self, message: ChatMessage):
         """保存消息到记忆"""
         if not self.storage:
@@ -177,22 +381,46 @@ class MemoryManager:
         
         try:
             # 保存到存储
+            content, metadata = self._to_storage(message)
             await self.storage.save_message(
                 user_id=message.user_id,
                 session_id=message.session_id,
                 role=message.role,
-                content=message.content if isinstance(message.content, str) else json.dumps(message.content),
-                metadata=message.metadata
+                content=content,
+                metadata=metadata
             )
             
             # 更新本地缓存
-            if self._local_cache:
-                cache_key = f"{message.user_id}:{message.session_id}"
-                if cache_key in self._local_cache:
-                    self._local_cache[cache_key].append(message)
+            if self._local_cache is not None:
+                cached_messages = self._local_cache.get((message.user_id, message.session_id))
+                if cached_messages is not None:
+                    cached_messages.append(message)
                 
-        except Exception as e:
-            print(f"保存消息到记忆失败: {e}")
+        except Exception:
+            _log.warning("保存消息到记忆失败", exc_info=True)
+    
+    async def save_messages(self, messages: List[ChatMessage]):
+        """按顺序批量保存同一会话的多条消息（一次存储写入）"""
+        if not self.storage or not messages:
+            return
+        
+        user_id = messages[0].user_id
+        session_id = messages[0].session_id
+        try:
+            documents = []
+            for message in messages:
+                content, metadata = self._to_storage(message)
+                documents.append({"role": message.role, "content": content, "metadata": metadata})
+            await self.storage.save_messages(user_id, session_id, documents)
+            
+            # 更新本地缓存
+            if self._local_cache is not None:
+                cached_messages = self._local_cache.get((user_id, session_id))
+                if cached_messages is not None:
+                    cached_messages.extend(messages)
+                
+        except Exception:
+            _log.warning("批量保存消息到记忆失败", exc_info=True)
     
     async def get_history(self, user_id: str, session_id: str, limit: int = None) -> List[ChatMessage]:
         """获取历史记录"""
@@ -200,46 +428,62 @@ class MemoryManager:
             return []
         
         try:
-            # 检查本地缓存
-            cache_key = f"{user_id}:{session_id}"
-            if self._local_cache and cache_key in self._local_cache:
-                cached_messages = self._local_cache[cache_key]
-                if limit:
-                    return cached_messages[-limit:]
-                return cached_messages
-            
-            # 从存储获取
-            messages_data = await self.storage.get_history(user_id, session_id, limit)
+            # 检查本地缓存（缓存只保留最近 _history_limit 条，更大的limit直接读取存储）
+            cache_key = (user_id, session_id)
+            use_cache = self._local_cache is not None and not (limit and self._history_limit and limit > self._history_limit)
+            cached_messages = self._local_cache.get(cache_key) if use_cache else None
+            if cached_messages is not None:
+                if limit and limit < len(cached_messages):
+                    return list(islice(cached_messages, len(cached_messages) - limit, None))
+                return list(cached_messages)
+            
+            # 从存储获取（需要缓存时按缓存窗口读取）
+            messages_data = await self.storage.get_history(user_id, session_id, self._history_limit if use_cache else limit)
             
             messages = []
             for msg_data in messages_data:
-                content = msg_data['content']
-                try:
-                    # 尝试解析JSON内容
-                    content = json.loads(content)
-                except (json.JSONDecodeError, TypeError):
-                    # 如果不是JSON，保持原样
-                    pass
-                
+                metadata = msg_data.get('metadata')
                 message = ChatMessage(
                     role=msg_data['role'],
-                    content=content,
-                    timestamp=msg_data.get('timestamp', datetime.now()),
+                    content=self._from_storage(msg_data['content'], metadata),
+                    timestamp=_epoch(msg_data.get('timestamp')),
                     user_id=user_id,
                     session_id=session_id,
-                    metadata=msg_data.get('metadata', {})
+                    # 存储可能返回共享的只读空元数据，对外统一为新的普通字典
+                    metadata=self._user_metadata(metadata)
                 )
                 messages.append(message)
             
             # 更新本地缓存
-            if self._local_cache:
-                self._local_cache[cache_key] = messages
+            if use_cache:
+                self._local_cache[cache_key] = deque(messages, maxlen=self._history_limit)
+                if limit and limit < len(messages):
+                    return messages[-limit:]
             
             return messages
             
-        except Exception as e:
-            print(f"获取历史记录失败: {e}")
+        except Exception:
+            _log.warning("获取历史记录失败", exc_info=True)
+            return []
+    
+    async def get_history_dicts(self, user_id: str, session_id: str, limit: int = None) -> Optional[List[Dict[str, Any]]]:
+        """获取请求格式的历史记录（只含role和content），构建请求消息时不再经过 ChatMessage
+        
+        直接读取存储，不经过本地 ChatMessage 缓存；QianwenClient 对每个会话只调用一次，
+        之后在本地追加。读取失败时返回None，调用方不应缓存结果。
+        """
+        if not self.storage:
             return []
+        
+        try:
+            messages_data = await self.storage.get_history(user_id, session_id, limit)
+            return [
+                {"role": msg_data['role'], "content": self._from_storage(msg_data['content'], msg_data.get('metadata'))}
+                for msg_data in messages_data
+            ]
+        except Exception:
+            _log.warning("获取历史记录失败", exc_info=True)
+            return None
     
     async def clear_history(self, user_id: str, session_id: str):
         """清除历史记录"""
@@ -250,13 +494,11 @@ class MemoryManager:
             await self.storage.clear_history(user_id, session_id)
             
             # 清除本地缓存
-            if self._local_cache:
-                cache_key = f"{user_id}:{session_id}"
-                if cache_key in self._local_cache:
-                    del self._local_cache[cache_key]
+            if self._local_cache is not None:
+                self._local_cache.pop((user_id, session_id), None)
                     
-        except Exception as e:
-            print(f"清除历史记录失败: {e}")
+        except Exception:
+            _log.warning("清除历史记录失败", exc_info=True)
     
     async def close(self):
         """关闭记忆管理器"""
@@ -281,7 +523,7 @@ class LogManager:
     
     async def log_request(self, user_id: str, session_id: str, request_data: Dict[str, Any], request_id: str = None) -> str:
         """记录请求日志"""
-        if not self.storage:
+        if not self.storage or not self.storage.requests_enabled:
             return request_id or str(uuid.uuid4())
         
         request_id = request_id or str(uuid.uuid4())
@@ -298,14 +540,14 @@ class LogManager:
             
             await self.storage.log_request(user_id, session_id, log_data)
             
-        except Exception as e:
-            print(f"记录请求日志失败: {e}")
+        except Exception:
+            _log.warning("记录请求日志失败", exc_info=True)
         
         return request_id
     
     async def log_response(self, user_id: str, session_id: str, response_data: Dict[str, Any], request_id: str = None):
         """记录响应日志"""
-        if not self.storage:
+        if not self.storage or not self.storage.responses_enabled:
             return
         
         try:
@@ -318,29 +560,31 @@ class LogManager:
             
             await self.storage.log_response(user_id, session_id, log_data, request_id)
             
-        except Exception as e:
-            print(f"记录响应日志失败: {e}")
+        except Exception:
+            _log.warning("记录响应日志失败", exc_info=True)
     
     async def log_error(self, user_id: str, session_id: str, error_data: Dict[str, Any]):
         """记录错误日志"""
-        if not self.storage:
+        if not self.storage or not self.storage.errors_enabled:
             return
         
         try:
             await self.storage.log_error(user_id, session_id, error_data)
             
-        except Exception as e:
-            print(f"记录错误日志失败: {e}")
+        except Exception:
+            _log.warning("记录错误日志失败", exc_info=True)
     
-    async def get_logs(self, user_id: str = None, session_id: str = None, start_time: datetime = None, end_time: datetime = None, limit: int = 100) -> List[Dict[str, Any]]:
-        """获取日志记录"""
+    async def get_logs(self, user_id: str = None, session_id: str = None, start_time: datetime = None, end_time: datetime = None, limit: int = 100, fields: List[str] = None) -> List[Dict[str, Any]]:
+        """获取日志记录（fields 仅在存储实现支持时传递）"""
         if not self.storage:
             return []
         
         try:
+            if fields:
+                return await self.storage.get_logs(user_id, session_id, start_time, end_time, limit, fields=fields)
             return await self.storage.get_logs(user_id, session_id, start_time, end_time, limit)
-        except Exception as e:
-            print(f"获取日志记录失败: {e}")
+        except Exception:
+            _log.warning("获取日志记录失败", exc_info=True)
             return []
     
     async def close(self):
@@ -357,15 +601,17 @@ class QianwenChat:
     def __init__(self, client: 'QianwenClient', user_id: str = None, session_id: str = None):
         self.client = client
         self._user_id = user_id or "default_user"
-        self._session_id = session_id or f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self._session_id = session_id or f"session_{time.strftime('%Y%m%d_%H%M%S')}"
         
         # 链式调用参数
         self._model = client.config.model.default_model
         self._temperature = client.config.model.default_temperature
         self._max_tokens = client.config.model.default_max_tokens
         self._system_message = client.config.model.default_system_message
+        self._system_entry = self._make_system_entry(self._system_message)
         self._search_enabled = False
         self._memory_enabled = client.config.memory.enabled
+        self._bind_memory_mode()
     
     # ============= 链式调用方法 =============
     
@@ -387,6 +633,7 @@ class QianwenChat:
     def system(self, message: str) -> 'QianwenChat':
         """设置系统提示"""
         self._system_message = message
+        self._system_entry = self._make_system_entry(message)
         return self
     
     def search(self, enabled: bool = True) -> 'QianwenChat':
@@ -397,6 +644,7 @@ class QianwenChat:
     def memory(self, enabled: bool = True) -> 'QianwenChat':
         """启用/禁用记忆功能"""
         self._memory_enabled = enabled
+        self._bind_memory_mode()
         return self
     
     def user(self, user_id: str) -> 'QianwenChat':
@@ -409,68 +657,47 @@ class QianwenChat:
         self._session_id = session_id
         return self
     
+    def freeze(self) -> 'FrozenChat':
+        """固定当前参数，返回请求模板只构建一次的会话"""
+        return FrozenChat(self)
+    
+    def _request_params(self, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """构建请求参数"""
+        request_params = {
+            "model": self._model,
+            "messages": messages,
+            "temperature": self._temperature,
+            "max_tokens": self._max_tokens,
+            **kwargs
+        }
+        
+        # 添加搜索工具
+        if self._search_enabled:
+            request_params["tools"] = _WEB_SEARCH_TOOLS
+        
+        return request_params
+    
     # ============= 对话方法 =============
     
     async def ask(self, message: str, **kwargs) -> Dict[str, Any]:
         """发送消息并获取回复"""
+        request_params: Optional[Dict[str, Any]] = None
         try:
             # 构建消息列表
             messages = await self._build_messages(message)
             
             # 构建请求参数
-            request_params = {
-                "model": self._model,
-                "messages": messages,
-                "temperature": self._temperature,
-                "max_tokens": self._max_tokens,
-                **kwargs
-            }
+            request_params = self._request_params(messages, kwargs)
             
-            # 添加搜索工具
-            if self._search_enabled:
-                request_params["tools"] = [{
-                    "type": "web_search",
-                    "web_search": {"enable": True}
-                }]
-            
-            # 记录请求日志
-            request_id = None
-            if self.client.log_manager:
-                request_id = await self.client.log_manager.log_request(
-                    self._user_id, self._session_id, request_params
-                )
+            # 记录请求日志（后台写入，不阻塞API调用）
+            request_id = self._log_request(request_params)
             
             # 发送请求
             response = await self.client.async_client.chat.completions.create(**request_params)
-            response_dict = response.model_dump()
+            response_dict = self._response_dict(response)
             
-            # 记录响应日志
-            if self.client.log_manager:
-                await self.client.log_manager.log_response(
-                    self._user_id, self._session_id, response_dict, request_id
-                )
-            
-            # 保存对话到记忆
-            if self._memory_enabled and self.client.memory_manager:
-                # 保存用户消息
-                user_message = ChatMessage(
-                    role="user",
-                    content=message,
-                    user_id=self._user_id,
-                    session_id=self._session_id
-                )
-                await self.client.memory_manager.save_message(user_message)
-                
-                # 保存助手回复
-                if response_dict.get('choices'):
-                    assistant_content = response_dict['choices'][0]['message']['content']
-                    assistant_message = ChatMessage(
-                        role="assistant",
-                        content=assistant_content,
-                        user_id=self._user_id,
-                        session_id=self._session_id
-                    )
-                    await self.client.memory_manager.save_message(assistant_message)
+            # 响应日志与对话记忆在后台写入，回复直接返回给调用方
+            self._persist(message, self._assistant_content(response), response_dict, request_id)
             
             return response_dict
             
@@ -481,87 +708,47 @@ class QianwenChat:
                     self._user_id, self._session_id, {
                         "error_type": type(e).__name__,
                         "error_message": str(e),
-                        "request_params": locals().get('request_params', {})
+                        "request_params": request_params or {}
                     }
                 )
             raise QianwenAPIError(f"API调用失败: {e}")
     
     async def stream(self, message: str, **kwargs) -> AsyncGenerator[Any, None]:
         """流式对话"""
+        request_params: Optional[Dict[str, Any]] = None
         try:
             # 构建消息列表
             messages = await self._build_messages(message)
             
             # 构建请求参数
-            request_params = {
-                "model": self._model,
-                "messages": messages,
-                "temperature": self._temperature,
-                "max_tokens": self._max_tokens,
-                "stream": True,
-                **kwargs
-            }
+            request_params = self._request_params(messages, {"stream": True, **kwargs})
             
-            # 添加搜索工具
-            if self._search_enabled:
-                request_params["tools"] = [{
-                    "type": "web_search",
-                    "web_search": {"enable": True}
-                }]
+            # 记录请求日志（后台写入，不阻塞API调用）
+            request_id = self._log_request(request_params)
             
-            # 记录请求日志
-            request_id = None
-            if self.client.log_manager:
-                request_id = await self.client.log_manager.log_request(
-                    self._user_id, self._session_id, request_params
-                )
-            
-            # 流式响应
-            full_content = ""
+            # 流式响应，回复片段收集到列表中，结束时一次拼接
+            parts = []
             
-            try:
-                # 尝试使用stream_options参数
+            # SDK支持时请求返回用量统计（支持情况在客户端创建时检测一次）
+            if self.client._supports_stream_options:
                 request_params["stream_options"] = {"include_usage": True}
-                stream = await self.client.async_client.chat.completions.create(**request_params)
-            except TypeError:
-                # 如果不支持stream_options，则移除该参数
-                request_params.pop("stream_options", None)
-                stream = await self.client.async_client.chat.completions.create(**request_params)
+            stream = await self.client.async_client.chat.completions.create(**request_params)
             
             async for chunk in stream:
                 yield chunk
                 
                 # 收集完整内容用于记忆保存
-                if chunk.choices and chunk.choices[0].delta.content:
-                    full_content += chunk.choices[0].delta.content
-            
-            # 保存对话到记忆
-            if self._memory_enabled and self.client.memory_manager and full_content:
-                # 保存用户消息
-                user_message = ChatMessage(
-                    role="user",
-                    content=message,
-                    user_id=self._user_id,
-                    session_id=self._session_id
-                )
-                await self.client.memory_manager.save_message(user_message)
-                
-                # 保存助手回复
-                assistant_message = ChatMessage(
-                    role="assistant",
-                    content=full_content,
-                    user_id=self._user_id,
-                    session_id=self._session_id
-                )
-                await self.client.memory_manager.save_message(assistant_message)
+                if chunk.choices:
+                    delta_content = chunk.choices[0].delta.content
+                    if delta_content:
+                        parts.append(delta_content)
             
-            # 记录响应日志
-            if self.client.log_manager:
-                await self.client.log_manager.log_response(
-                    self._user_id, self._session_id, 
-                    {"content": full_content, "stream": True}, 
-                    request_id
-                )
+            # 响应日志与对话记忆在后台写入，流结束后不再等待存储
+            full_content = "".join(parts)
+            self._persist(
+                message, full_content, {"content": full_content, "stream": True}, request_id,
+                remember=bool(full_content)
+            )
             
         except Exception as e:
             # 记录错误日志
@@ -570,18 +757,18 @@ class QianwenChat:
                     self._user_id, self._session_id, {
                         "error_type": type(e).__name__,
                         "error_message": str(e),
-                        "request_params": locals().get('request_params', {})
+                        "request_params": request_params or {}
                     }
                 )
             raise QianwenAPIError(f"流式API调用失败: {e}")
     
     async def image(self, message: str, image_path: str, **kwargs) -> Dict[str, Any]:
         """图像理解"""
-        if not os.path.exists(image_path):
+        if not await asyncio.to_thread(os.path.exists, image_path):
             raise QianwenAPIError(f"图片文件不存在: {image_path}")
         
-        # 编码图片
-        image_base64 = self.client._encode_image(image_path)
+        # 编码图片（在线程中执行，不阻塞事件循环）
+        mime_type, image_base64 = await asyncio.to_thread(self.client._encode_image_cached, image_path)
         
         # 构建多模态消息
         multimodal_message = [
@@ -589,7 +776,7 @@ class QianwenChat:
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_base64}"
+                    "url": f"data:{mime_type};base64,{image_base64}"
                 }
             }
         ]
@@ -598,14 +785,19 @@ class QianwenChat:
     
     async def video(self, message: str, video_frames: List[str], **kwargs) -> Dict[str, Any]:
         """视频理解"""
+        missing = await asyncio.to_thread(_missing_files, video_frames)
+        if missing:
+            raise QianwenAPIError(f"视频帧文件不存在: {missing[0]}")
+        
+        # 各帧在线程中并发编码
+        encoded_frames = await asyncio.gather(*(
+            asyncio.to_thread(self.client._encode_image_cached, frame_path) for frame_path in video_frames
+        ))
+        
         # 构建多模态消息
         multimodal_message = [{"type": "text", "text": message}]
         
-        for frame_path in video_frames:
-            if not os.path.exists(frame_path):
-                raise QianwenAPIError(f"视频帧文件不存在: {frame_path}")
-            
-            frame_base64 = self.client._encode_image(frame_path)
+        for _, frame_base64 in encoded_frames:
             multimodal_message.append({
                 "type": "video_url",
                 "video_url": {
@@ -617,13 +809,12 @@ class QianwenChat:
     
     async def document(self, message: str, document_path: str, **kwargs) -> Dict[str, Any]:
         """文档理解"""
-        if not os.path.exists(document_path):
+        if not await asyncio.to_thread(os.path.exists, document_path):
             raise QianwenAPIError(f"文档文件不存在: {document_path}")
         
-        # 读取文档内容（这里简化处理，实际可能需要更复杂的文档解析）
+        # 读取文档内容（在线程中执行；这里简化处理，实际可能需要更复杂的文档解析）
         try:
-            with open(document_path, 'r', encoding='utf-8') as f:
-                doc_content = f.read()
+            doc_content = await asyncio.to_thread(_read_text_file, document_path)
         except UnicodeDecodeError:
             # 如果是二进制文档，可能需要特殊处理
             raise QianwenAPIError(f"无法读取文档内容: {document_path}")
@@ -635,33 +826,10 @@ class QianwenChat:
     
     async def _multimodal_request(self, content: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
         """多模态请求的通用方法"""
+        request_params: Optional[Dict[str, Any]] = None
         try:
-            # 获取历史记录
-            messages = []
-            if self._memory_enabled and self.client.memory_manager:
-                history = await self.client.memory_manager.get_history(
-                    self._user_id, self._session_id, 
-                    limit=self.client.config.memory.max_history_length
-                )
-                
-                for msg in history:
-                    messages.append({
-                        "role": msg.role,
-                        "content": msg.content
-                    })
-            
-            # 添加系统消息
-            if self._system_message:
-                messages.insert(0, {
-                    "role": "system",
-                    "content": self._system_message
-                })
-            
-            # 添加当前多模态消息
-            messages.append({
-                "role": "user",
-                "content": content
-            })
+            # 构建消息列表（当前消息为多模态内容）
+            messages = await self._build_messages(content)
             
             # 构建请求参数
             request_params = {
@@ -672,44 +840,15 @@ class QianwenChat:
                 **kwargs
             }
             
-            # 记录请求日志
-            request_id = None
-            if self.client.log_manager:
-                request_id = await self.client.log_manager.log_request(
-                    self._user_id, self._session_id, request_params
-                )
+            # 记录请求日志（后台写入，不阻塞API调用）
+            request_id = self._log_request(request_params)
             
             # 发送请求
             response = await self.client.async_client.chat.completions.create(**request_params)
-            response_dict = response.model_dump()
-            
-            # 记录响应日志
-            if self.client.log_manager:
-                await self.client.log_manager.log_response(
-                    self._user_id, self._session_id, response_dict, request_id
-                )
+            response_dict = self._response_dict(response)
             
-            # 保存对话到记忆
-            if self._memory_enabled and self.client.memory_manager:
-                # 保存用户消息
-                user_message = ChatMessage(
-                    role="user",
-                    content=content,
-                    user_id=self._user_id,
-                    session_id=self._session_id
-                )
-                await self.client.memory_manager.save_message(user_message)
-                
-                # 保存助手回复
-                if response_dict.get('choices'):
-                    assistant_content = response_dict['choices'][0]['message']['content']
-                    assistant_message = ChatMessage(
-                        role="assistant",
-                        content=assistant_content,
-                        user_id=self._user_id,
-                        session_id=self._session_id
-                    )
-                    await self.client.memory_manager.save_message(assistant_message)
+            # 响应日志与对话记忆在后台写入，回复直接返回给调用方
+            self._persist(content, self._assistant_content(response), response_dict, request_id)
             
             return response_dict
             
@@ -720,34 +859,30 @@ class QianwenChat:
                     self._user_id, self._session_id, {
                         "error_type": type(e).__name__,
                         "error_message": str(e),
-                        "request_params": locals().get('request_params', {})
+                        "request_params": request_params or {}
                     }
                 )
             raise QianwenAPIError(f"多模态API调用失败: {e}")
     
-    async def _build_messages(self, message: str) -> List[Dict[str, Any]]:
-        """构建消息列表"""
-        messages = []
-        
-        # 添加系统消息
-        if self._system_message:
-            messages.append({
-                "role": "system",
-                "content": self._system_message
-            })
+    @staticmethod
+    def _make_system_entry(message: Optional[str]) -> Optional[Dict[str, Any]]:
+        """构建系统消息（设置时构建一次，每轮请求复用）"""
+        return {"role": "system", "content": message} if message else None
+    
+    def _bind_memory_mode(self):
+        """按记忆开关绑定消息构建方法，每轮对话不再判断记忆开关"""
+        if self._memory_enabled:
+            self._build_messages = self._build_messages_with_memory
+        else:
+            self._build_messages = self._build_messages_no_memory
+    
+    async def _build_messages_with_memory(self, message: Any) -> List[Dict[str, Any]]:
+        """构建消息列表：系统消息 + 会话历史 + 当前消息"""
+        messages = [self._system_entry] if self._system_entry else []
         
-        # 获取历史记录
-        if self._memory_enabled and self.client.memory_manager:
-            history = await self.client.memory_manager.get_history(
-                self._user_id, self._session_id, 
-                limit=self.client.config.memory.max_history_length
-            )
-            
-            for msg in history:
-                messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
+        # 获取历史记录（客户端未初始化记忆管理器时跳过）
+        if self.client.memory_manager:
+            messages.extend(await self._load_history())
         
         # 添加当前消息
         messages.append({
@@ -757,25 +892,158 @@ class QianwenChat:
         
         return messages
     
+    async def _build_messages_no_memory(self, message: Any) -> List[Dict[str, Any]]:
+        """构建消息列表（未启用记忆）：系统消息 + 当前消息"""
+        current = {"role": "user", "content": message}
+        return [self._system_entry, current] if self._system_entry else [current]
+    
+    # ============= 后台写入 =============
+    
+    def _log_request(self, request_params: Dict[str, Any]) -> Optional[str]:
+        """在后台记录请求日志，请求ID在本地生成，无需等待写入完成"""
+        if not self.client.log_manager:
+            return None
+        request_id = str(uuid.uuid4())
+        self.client._spawn(self.client.log_manager.log_request(
+            self._user_id, self._session_id, request_params, request_id
+        ))
+        return request_id
+    
+    @staticmethod
+    def _response_dict(response: Any) -> Dict[str, Any]:
+        """按需转换响应：只序列化choices和usage，其余字段直接读取属性"""
+        usage = response.usage
+        return {
+            "id": response.id,
+            "object": response.object,
+            "created": response.created,
+            "model": response.model,
+            "choices": [choice.model_dump() for choice in response.choices],
+            "usage": usage.model_dump() if usage is not None else None
+        }
+    
+    @staticmethod
+    def _assistant_content(response: Any) -> Any:
+        """直接从响应对象中提取助手回复"""
+        if response.choices:
+            return response.choices[0].message.content
+        return None
+    
+    def _persist(self, user_content: Any, assistant_content: Any, response_data: Dict[str, Any], request_id: Optional[str], remember: bool = True):
+        """在后台记录响应日志并保存本轮对话（remember为False时只记录日志）"""
+        jobs = []
+        if self.client.log_manager:
+            jobs.append(self.client.log_manager.log_response(
+                self._user_id, self._session_id, response_data, request_id
+            ))
+        if remember and self._memory_enabled and self.client.memory_manager:
+            self._remember_turn(user_content, assistant_content)
+            jobs.append(self._save_turn(user_content, assistant_content))
+        if jobs:
+            self.client._spawn_persist((self._user_id, self._session_id), asyncio.gather(*jobs))
+    
+    async def _save_turn(self, user_content: Any, assistant_content: Any):
+        """一次写入保存用户消息和助手回复"""
+        messages = [ChatMessage(
+            role="user",
+            content=user_content,
+            user_id=self._user_id,
+            session_id=self._session_id
+        )]
+        if assistant_content is not None:
+            messages.append(ChatMessage(
+                role="assistant",
+                content=assistant_content,
+                user_id=self._user_id,
+                session_id=self._session_id
+            ))
+        await self.client.memory_manager.save_messages(messages)
+    
+    def _new_history(self, messages=()) -> deque:
+        """创建会话历史容器，只保留最近 max_history_length 条"""
+        return deque(messages, maxlen=self.client.config.memory.max_history_length or None)
+    
+    async def _load_history(self) -> deque:
+        """获取会话历史，只在会话首次使用时读取记忆存储（同一会话的对话对象共用）"""
+        key = (self._user_id, self._session_id)
+        history = self.client._get_session_history(key)
+        if history is None:
+            await self._wait_persisted()
+            messages = await self.client.memory_manager.get_history_dicts(
+                self._user_id, self._session_id, 
+                limit=self.client.config.memory.max_history_length
+            )
+            if messages is None:
+                # 读取失败时不缓存，下次对话重新从存储加载
+                return self._new_history()
+            history = self.client._set_session_history(key, self._new_history(messages), replace=False)
+        return history
+    
+    def _remember_turn(self, user_content: Any, assistant_content: Any):
+        """把本轮对话追加到已加载的会话历史"""
+        history = self.client._get_session_history((self._user_id, self._session_id))
+        if history is None:
+            return
+        history.append({"role": "user", "content": user_content})
+        if assistant_content is not None:
+            history.append({"role": "assistant", "content": assistant_content})
+    
+    async def _wait_persisted(self):
+        """等待当前会话尚未完成的写入（包括同一会话的其他对话对象），保证读取历史时包含之前的消息"""
+        await self.client._wait_persisted((self._user_id, self._session_id))
+    
     # ============= 记忆管理方法 =============
     
     async def clear_memory(self):
         """清除当前会话的记忆"""
         if self.client.memory_manager:
+            await self._wait_persisted()
             await self.client.memory_manager.clear_history(self._user_id, self._session_id)
+            self.client._set_session_history((self._user_id, self._session_id), self._new_history())
     
     async def get_history(self, limit: int = None) -> List[ChatMessage]:
         """获取历史记录"""
         if self.client.memory_manager:
+            await self._wait_persisted()
             return await self.client.memory_manager.get_history(self._user_id, self._session_id, limit)
         return []
 
 
+class FrozenChat(QianwenChat):
+    """参数固定的对话会话 - 由 QianwenChat.freeze() 创建
+    
+    模型、温度、最大长度、系统提示和搜索设置在创建时固定，请求参数模板只构建一次，
+    每次对话只填入消息列表。用户、会话和记忆开关仍可修改。
+    """
+    
+    def __init__(self, chat: QianwenChat):
+        self.__dict__.update(chat.__dict__)
+        self._bind_memory_mode()
+        self._base_request = QianwenChat._request_params(self, None, {})
+    
+    def _frozen(self, *args, **kwargs):
+        raise QianwenAPIError("会话参数已固定，请在调用freeze()之前设置")
+    
+    model = temperature = max_tokens = system = search = _frozen
+    
+    def _request_params(self, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """基于预构建的模板生成请求参数"""
+        return {**self._base_request, "messages": messages, **kwargs}
+
+
 # ============= 主客户端类 =============
 
 class QianwenClient:
     """千问客户端 - 增强版"""
     
+    # HTTP连接池配置（安装了h2时启用HTTP/2，多个请求复用同一连接）
+    HTTP_MAX_CONNECTIONS = 200
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 100
+    HTTP_KEEPALIVE_EXPIRY = 60  # 秒
+    
+    # 本地保留最近消息的会话数量上限，超出时淘汰最久未使用的会话（之后重新从记忆存储加载）
+    MAX_SESSION_HISTORIES = 1024
+    
     def __init__(self, config: Union[QianwenConfig, Dict[str, Any], str] = None, **kwargs):
         # 处理配置
         if config is None:
@@ -789,29 +1057,67 @@ class QianwenClient:
         else:
             raise ValueError("配置参数类型错误")
         
-        # 应用kwargs覆盖配置
-        if 'api_key' in kwargs:
-            self.config.api.api_key = kwargs['api_key']
-        if 'base_url' in kwargs:
-            self.config.api.base_url = kwargs['base_url']
+        # 应用kwargs覆盖配置（生成新的配置对象，避免修改from_env缓存的共享实例）
+        api_overrides = {key: kwargs[key] for key in ('api_key', 'base_url') if key in kwargs}
+        if api_overrides:
+            self.config = replace(self.config, api=replace(self.config.api, **api_overrides))
         
         # 检查API密钥
         if not self.config.api.api_key:
             raise QianwenAPIError("未设置API密钥，请设置QIANWEN_API_KEY环境变量或在配置中指定")
         
-        # 初始化OpenAI客户端
+        # 初始化OpenAI客户端（共享调优过的HTTP连接池）
+        self._http_client = None
+        if httpx is not None:
+            self._http_client = httpx.AsyncClient(
+                http2=_HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=self.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=self.HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=self.config.api.timeout,
+                follow_redirects=True
+            )
         self.async_client = AsyncOpenAI(
             api_key=self.config.api.api_key,
             base_url=self.config.api.base_url,
-            timeout=self.config.api.timeout
+            timeout=self.config.api.timeout,
+            http_client=self._http_client
+        )
+        self._supports_stream_options = self._accepts_param(
+            self.async_client.chat.completions.create, "stream_options"
         )
         
         # 初始化管理器
         self.memory_manager = None
         self.log_manager = None
+        # 尚未完成的后台写入任务（日志、记忆），close() 时等待
+        self._pending_tasks: set = set()
+        # 按 (user_id, session_id) 记录尚未完成的对话写入，读取该会话历史前等待
+        self._session_tasks: Dict[Tuple[str, str], set] = {}
+        # 按 (user_id, session_id) 保存会话最近的消息（请求消息格式），同一会话的对话对象共用
+        self._session_histories: OrderedDict = OrderedDict()
+        # 连接预热任务，close() 时取消
+        self._warmup_task: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def _accepts_param(func: Callable, name: str) -> bool:
+        """检测SDK方法是否接受指定参数"""
+        try:
+            parameters = inspect.signature(func).parameters
+        except (TypeError, ValueError):
+            return False
+        return name in parameters or any(
+            p.kind is inspect.Parameter.VAR_KEYWORD for p in parameters.values()
+        )
     
     async def initialize(self):
         """初始化客户端"""
+        # 预热API连接（DNS、TCP、TLS），与存储初始化并行进行
+        if self._warmup_task is None:
+            self._warmup_task = asyncio.ensure_future(self._warmup())
+        
         # 初始化记忆管理器
         if self.config.memory.enabled:
             self.memory_manager = MemoryManager(self.config.memory)
@@ -822,14 +1128,71 @@ class QianwenClient:
             self.log_manager = LogManager(self.config.log)
             await self.log_manager.initialize()
     
+    async def _warmup(self):
+        """发送一次轻量请求建立连接，失败不影响后续调用"""
+        try:
+            await self.async_client.models.list()
+        except Exception:
+            pass
+    
     def chat(self, user_id: str = None, session_id: str = None) -> QianwenChat:
         """创建对话会话"""
         return QianwenChat(self, user_id, session_id)
     
     def _encode_image(self, image_path: str) -> str:
         """编码图片为base64"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        return self._encode_image_cached(image_path)[1]
+    
+    def _encode_image_cached(self, image_path: str) -> Tuple[str, str]:
+        """编码图片为base64（按路径、修改时间和大小缓存），返回 (MIME类型, base64字符串)"""
+        stat = os.stat(image_path)
+        return _encode_file(image_path, stat.st_mtime_ns, stat.st_size)
+    
+    def _spawn(self, coro) -> asyncio.Task:
+        """以后台任务运行日志/记忆写入，并跟踪到完成为止"""
+        task = asyncio.ensure_future(coro)
+        self._pending_tasks.add(task)
+        task.add_done_callback(self._pending_tasks.discard)
+        return task
+    
+    def _spawn_persist(self, key: Tuple[str, str], coro) -> asyncio.Task:
+        """在后台写入一轮对话，并登记到所属会话"""
+        task = self._spawn(coro)
+        tasks = self._session_tasks.setdefault(key, set())
+        tasks.add(task)
+        
+        def done(task):
+            tasks.discard(task)
+            if not tasks and self._session_tasks.get(key) is tasks:
+                del self._session_tasks[key]
+        
+        task.add_done_callback(done)
+        return task
+    
+    def _get_session_history(self, key: Tuple[str, str]) -> Optional[deque]:
+        """获取已加载的会话历史，未加载时返回None"""
+        history = self._session_histories.get(key)
+        if history is not None:
+            self._session_histories.move_to_end(key)
+        return history
+    
+    def _set_session_history(self, key: Tuple[str, str], history: deque, replace: bool = True) -> deque:
+        """保存会话历史；replace为False且已有其他对话对象加载的历史时，沿用已有的"""
+        if not replace:
+            existing = self._get_session_history(key)
+            if existing is not None:
+                return existing
+        self._session_histories[key] = history
+        self._session_histories.move_to_end(key)
+        if len(self._session_histories) > self.MAX_SESSION_HISTORIES:
+            self._session_histories.popitem(last=False)
+        return history
+    
+    async def _wait_persisted(self, key: Tuple[str, str]):
+        """等待指定会话尚未完成的对话写入"""
+        tasks = self._session_tasks.get(key)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
     
     def get_models(self) -> Dict[str, Any]:
         """获取可用模型列表"""
@@ -840,19 +1203,25 @@ class QianwenClient:
             "vision_models": ["qwen-vl-plus", "qwen-vl-max"]
         }
     
-    async def get_logs(self, user_id: str = None, session_id: str = None, start_time: datetime = None, end_time: datetime = None, limit: int = 100) -> List[Dict[str, Any]]:
+    async def get_logs(self, user_id: str = None, session_id: str = None, start_time: datetime = None, end_time: datetime = None, limit: int = 100, fields: List[str] = None) -> List[Dict[str, Any]]:
         """获取日志记录"""
         if self.log_manager:
-            return await self.log_manager.get_logs(user_id, session_id, start_time, end_time, limit)
+            return await self.log_manager.get_logs(user_id, session_id, start_time, end_time, limit, fields)
         return []
     
     async def close(self):
-        """关闭客户端"""
+        """关闭客户端（先等待后台写入完成）"""
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        if self._pending_tasks:
+            await asyncio.gather(*self._pending_tasks, return_exceptions=True)
         if self.memory_manager:
             await self.memory_manager.close()
         if self.log_manager:
             await self.log_manager.close()
         await self.async_client.close()
+        if self._http_client is not None:
+            await self._http_client.aclose()
     
     async def __aenter__(self):
         await self.initialize()
@@ -874,6 +1243,16 @@ def create_async_client(config: Union[QianwenConfig, Dict[str, Any], str] = None
     return QianwenClient(config, **kwargs)
 
 
+def install_uvloop() -> bool:
+    """使用uvloop作为asyncio事件循环（需在 asyncio.run 之前调用），未安装uvloop时返回False"""
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
 # ============= 测试代码 =============
 
 if __name__ == "__main__":
@@ -890,4 +1269,5 @@ if __name__ == "__main__":
         
         await client.close()
     
+    install_uvloop()
     asyncio.run(test())
\ No newline at end of file